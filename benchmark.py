@@ -0,0 +1,263 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for the spc module on synthetic .SPC files
+
+Generates files of each layout (gx-y, x-y, -xy and the old format) and y-data
+type (float, 32 bit and 16 bit integers), then times reading the header,
+loading the file, accessing subfiles and exporting text. The results are
+printed as a table, and can be saved as JSON to compare between versions.
+
+author: Rohan Isaac
+"""
+from __future__ import division, absolute_import, unicode_literals, print_function
+import argparse
+import json
+import os
+import platform
+import shutil
+import struct
+import sys
+import tempfile
+import timeit
+
+import numpy as np
+
+import spc
+
+try:
+    import tracemalloc
+except ImportError:
+    # python 2, peak memory is not reported
+    tracemalloc = None
+
+layouts = ['gx-y', 'x-y', '-xy', 'old']
+ytypes = ['float', 'int', 'int16']
+phases = ['header', 'load', 'mmap', 'subfile', 'iter', 'text']
+
+# the old format can't store 16 bit data, and -xy data is always stored as
+# integers so float would repeat the int benchmark
+skip = [('old', 'int16'), ('-xy', 'float')]
+
+# number of random subfiles read in the subfile phase
+n_access = 100
+
+
+# ------------------------------------------------------------------------
+# Synthetic files
+# ------------------------------------------------------------------------
+
+
+def make_data(nsub, npts, seed=0):
+    """ Spectrum like y-data, a few peaks on a baseline plus noise """
+    rng = np.random.RandomState(seed)
+    t = np.linspace(0, 1, npts)
+    base = 1000 * np.exp(-((t - 0.3) / 0.02)**2) + 400 * np.exp(-((t - 0.7) / 0.05)**2)
+    scale = rng.uniform(0.5, 2.0, (nsub, 1))
+    return scale * base + rng.normal(0, 5, (nsub, npts)) + 100
+
+
+def make_file(path, layout, ytype, nsub, npts, seed=0, msb=False):
+    """
+    Write a synthetic .SPC file
+
+    Arguments
+    ---------
+    path: str
+        file to write
+    layout: str
+        'gx-y', 'x-y', '-xy' or 'old'
+    ytype: str
+        'float', 'int' or 'int16', the old format can't store 16 bit data
+    nsub, npts: int
+        number of subfiles and points in each subfile
+    msb: bool (default=False)
+        write the new format layouts big-endian (MSB 1st)
+    """
+    y = make_data(nsub, npts, seed)
+    z = np.arange(nsub, dtype=np.float64)
+    if layout == 'gx-y':
+        spc.write(path, np.linspace(400, 4000, npts), y, z=z, dtype=ytype, msb=msb)
+    elif layout == 'x-y':
+        x = np.cumsum(np.random.RandomState(seed).uniform(0.5, 1.5, npts)) + 400
+        spc.write(path, x, y, z=z, dtype=ytype, msb=msb)
+    elif layout == '-xy':
+        # same number of points, but different x values in each subfile
+        x0 = np.linspace(400, 4000, npts)
+        x = [x0 + i % 10 for i in range(nsub)]
+        spc.write(path, x, list(y), z=z, dtype=ytype, msb=msb)
+    elif layout == 'old':
+        write_old(path, y, 400, 4000, ytype)
+    else:
+        raise ValueError("unknown layout %r" % (layout,))
+
+
+def write_old(path, y, first, last, ytype='int'):
+    """ Write y-data as an old format (0x4d) .SPC file, which the spc module
+    only reads """
+    nsub, npts = y.shape
+    sub_head = np.zeros(nsub, spc.File.subhead_dtype)
+    sub_head['subindx'] = np.arange(nsub)
+    if ytype == 'float':
+        sub_head['subexp'] = 128
+        y_dat = y.astype('<f4')
+    elif ytype == 'int':
+        exp = np.floor(np.log2(np.abs(y).max(axis=1))).astype(int) + 2
+        sub_head['subexp'] = exp
+        y_int = np.rint(y * 2.0**(32 - exp[:, None])).astype('<i4')
+        # stored as 16 bit words, most significant word first
+        y_dat = y_int.view('<u2').reshape(nsub, npts, 2)[:, :, ::-1].copy()
+    else:
+        raise ValueError("old format files can't store %r data" % (ytype,))
+
+    rec = np.zeros(nsub, [('head', spc.File.subhead_dtype), ('y', y_dat.dtype, y_dat.shape[1:])])
+    rec['head'] = sub_head
+    rec['y'] = y_dat
+    data = rec.tobytes()
+
+    ftflg = 4 if nsub > 1 else 0
+    oexp = int(sub_head['subexp'].max())
+    head = struct.pack(spc.File.old_head_str.encode('utf8'),
+                       struct.pack(b'B', ftflg), b'\x4d', oexp, float(npts), first, last,
+                       b'\x00', b'\x00', 0, b'\x00', b'\x00', b'\x00', b'\x00', b'', 0, 0,
+                       b'', b'synthetic benchmark file', b'', data[:32])
+
+    with open(path, 'wb') as f:
+        # the first subheader is the end of the header
+        f.write(head)
+        f.write(data[32:])
+
+
+# ------------------------------------------------------------------------
+# Timing
+# ------------------------------------------------------------------------
+
+
+def phase_funcs(path, out_dir):
+    """ Function to run for each benchmark phase """
+    def header():
+        spc.read_header(path)
+
+    def load():
+        spc.File(path).y_matrix
+
+    def mmap():
+        with spc.File(path, mmap=True) as f:
+            f.y_matrix
+
+    def subfile():
+        with spc.File(path, mmap=True) as f:
+            idx = np.random.RandomState(0).randint(0, len(f.sub), n_access)
+            for i in idx:
+                f.sub[i].y
+
+    def iterate():
+        for x, sub in spc.iter_subfiles(path):
+            sub.y
+
+    def text():
+        out = os.path.join(out_dir, 'bench.txt')
+        spc.File(path).write_file(out)
+        os.remove(out)
+
+    return {'header': header, 'load': load, 'mmap': mmap, 'subfile': subfile,
+            'iter': iterate, 'text': text}
+
+
+def run_phase(func, repeat):
+    """ Best time of repeat runs and peak memory allocated in a traced run,
+    in seconds and bytes """
+    times = []
+    for i in range(repeat):
+        t0 = timeit.default_timer()
+        func()
+        times.append(timeit.default_timer() - t0)
+
+    peak = None
+    if tracemalloc is not None:
+        # separate run, tracing slows down the allocations
+        tracemalloc.start()
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return min(times), peak
+
+
+def run(shapes, layout_list, ytype_list, phase_list, repeat, out_dir, msb=False):
+    """ Generate each file and benchmark it, returns a list of results """
+    results = []
+    for nsub, npts in shapes:
+        for layout in layout_list:
+            for ytype in ytype_list:
+                if (layout, ytype) in skip:
+                    continue
+                path = os.path.join(out_dir, '%s_%s_%ix%i.spc'
+                                    % (layout.strip('-'), ytype, nsub, npts))
+                make_file(path, layout, ytype, nsub, npts, msb=msb)
+                size = os.path.getsize(path)
+                funcs = phase_funcs(path, out_dir)
+                for phase in phase_list:
+                    seconds, peak = run_phase(funcs[phase], repeat)
+                    res = {'layout': layout, 'ytype': ytype, 'nsub': nsub, 'npts': npts,
+                           'msb': msb and layout != 'old', 'file_bytes': size, 'phase': phase, 'seconds': seconds,
+                           'mb_per_s': size / seconds / 1e6 if seconds > 0 else None,
+                           'peak_bytes': peak}
+                    results.append(res)
+                    print('{layout:>5} {ytype:>6} {nsub:>7}x{npts:<8} {phase:>8} '
+                          '{seconds:10.4f} s {mb:10.1f} MB/s {peak:>10} MB'.format(
+                              mb=res['mb_per_s'] or 0.0,
+                              peak='-' if peak is None else '%.1f' % (peak / 1e6), **res))
+                    sys.stdout.flush()
+                if os.path.isfile(path):
+                    os.remove(path)
+    return results
+
+
+def parse_shape(s):
+    """ NSUBxNPTS to (nsub, npts) """
+    try:
+        nsub, npts = s.lower().split('x')
+        return int(nsub), int(npts)
+    except ValueError:
+        raise argparse.ArgumentTypeError("shape must be NSUBxNPTS, e.g. 100x1000, not %r" % s)
+
+
+def main():
+    desc = 'Benchmarks the spc module on synthetic .SPC files'
+    parser = argparse.ArgumentParser(description=desc)
+    parser.add_argument('-s', '--shape', type=parse_shape, action='append',
+                        help='Number of subfiles and points as NSUBxNPTS, can be repeated '
+                        '[default: 1x100000 100x1000 10000x100]')
+    parser.add_argument('-l', '--layout', choices=layouts, action='append',
+                        help='File layout, can be repeated [default: all]')
+    parser.add_argument('-y', '--ytype', choices=ytypes, action='append',
+                        help='Type of y-data, can be repeated [default: all]')
+    parser.add_argument('-p', '--phase', choices=phases, action='append',
+                        help='Phase to time, can be repeated [default: all]')
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help='Number of timed runs, the best is reported [default: 3]')
+    parser.add_argument('-m', '--msb', action='store_true',
+                        help='Write the new format layouts big-endian (MSB 1st)')
+    parser.add_argument('-o', '--output', help='Save the results as JSON to this file')
+    parser.add_argument('-d', '--dir', help='Directory for the generated files, which are '
+                        'removed after each benchmark [default: temporary directory]')
+    args = parser.parse_args()
+
+    shapes = args.shape or [(1, 100000), (100, 1000), (10000, 100)]
+    out_dir = args.dir or tempfile.mkdtemp(prefix='spc_bench')
+    try:
+        results = run(shapes, args.layout or layouts, args.ytype or ytypes,
+                      args.phase or phases, args.repeat, out_dir, args.msb)
+    finally:
+        if args.dir is None:
+            shutil.rmtree(out_dir, ignore_errors=True)
+
+    if args.output:
+        info = {'python': platform.python_version(), 'numpy': np.__version__,
+                'platform': platform.platform(), 'repeat': args.repeat,
+                'results': results}
+        with open(args.output, 'w') as f:
+            json.dump(info, f, indent=1)
+
+if __name__ == '__main__':
+    main()
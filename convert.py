@@ -1,18 +1,186 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 """
-Command line utility to convert .SPC files to .TXT
+Command line utility to convert .SPC files to .TXT or NumPy .NPZ/.NPY
 
 author: Rohan Isaac
 """
 from __future__ import division, absolute_import, unicode_literals, print_function
 import argparse
+import functools
+import hashlib
+import json
+import multiprocessing
 import os
+import shutil
+import tempfile
+import time
 import spc
 
+# suffix of the output directories of --npy, e.g. run1.spc to run1_npy/
+NPY_EXTEN = '_npy'
+
+
+def convert_file(fpath, exten, delim):
+    """ Convert a single spc file, returns (success, status message)
+
+    The output is written under a temporary name and only renamed once
+    complete, so a failed conversion leaves no partial output behind. A
+    directory of .npy files only replaces a directory that is an earlier
+    output (holds a header.json) """
+    foutp = fpath[:-4] + exten
+    npy = exten == NPY_EXTEN
+    if npy and os.path.exists(foutp) and not is_npy_output(foutp):
+        return False, 'Not replacing %s, it is not an earlier output' % foutp
+    tmp = None
+    try:
+        f = spc.File(fpath)
+        if npy:
+            # a new directory, so only ever removing what was written here
+            folder, stem = os.path.split(fpath[:-4])
+            tmp = tempfile.mkdtemp(suffix='.part', prefix=stem + '.', dir=folder or None)
+            umask = os.umask(0)
+            os.umask(umask)
+            os.chmod(tmp, 0o777 & ~umask)
+            f.write_npy(tmp)
+            if os.path.isdir(foutp):
+                shutil.rmtree(foutp)
+        else:
+            tmp = fpath[:-4] + '.part' + exten
+            if exten == '.npz':
+                f.write_npz(tmp)
+            else:
+                f.write_file(tmp, delimiter=delim)
+        # os.rename doesn't replace files on windows
+        getattr(os, 'replace', os.rename)(tmp, foutp)
+        return True, 'Converted'
+    except:
+        if tmp is not None and os.path.isdir(tmp):
+            shutil.rmtree(tmp)
+        elif tmp is not None and os.path.isfile(tmp):
+            os.remove(tmp)
+        return False, 'Error processing %s' % fpath
+
+
+def is_npy_output(path):
+    """ Whether path is a directory of .npy files written by write_npy """
+    return os.path.isfile(os.path.join(path, 'header.json'))
+
+
+def file_hash(fpath, block=2**20):
+    """ SHA-1 of the contents of a file, as a hex string """
+    h = hashlib.sha1()
+    with open(fpath, 'rb') as f:
+        for chunk in iter(functools.partial(f.read, block), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def process_file(fpath, exten, delim, update=False, entry=None, record=False):
+    """
+    Convert a single spc file, unless update is set and the output is up to
+    date: made from a file with the same size and time or contents according
+    to its manifest entry, or when no manifest is kept (record not set),
+    newer than the file
+
+    Returns (state, status message, manifest entry), state is 'converted',
+    'skipped' or 'error', the entry is only made if record is set
+    """
+    foutp = fpath[:-4] + exten
+    st = os.stat(fpath)
+    digest = None
+    if update and os.path.exists(foutp):
+        if entry is not None and entry.get('output') == foutp:
+            # the manifest knows what the output was made from
+            if [entry.get('size'), entry.get('mtime')] == [st.st_size, st.st_mtime]:
+                return 'skipped', 'Up to date', entry
+            if entry.get('size') == st.st_size:
+                # changed time, e.g. copied, check the contents
+                digest = file_hash(fpath)
+                if digest == entry.get('sha1'):
+                    return 'skipped', 'Unchanged', dict(entry, mtime=st.st_mtime)
+        elif not record and output_mtime(foutp) >= st.st_mtime:
+            return 'skipped', 'Up to date', entry
+
+    success, status = convert_file(fpath, exten, delim)
+    if not success:
+        return 'error', status, entry
+    if record:
+        entry = {'size': st.st_size, 'mtime': st.st_mtime, 'sha1': digest or file_hash(fpath),
+                 'output': foutp, 'converted': time.strftime('%Y-%m-%dT%H:%M:%S')}
+    return 'converted', status, entry
+
+
+def output_mtime(foutp):
+    """ Modification time of an output, for a directory of .npy files that of
+    its header.json (written last), as rewriting the files inside doesn't
+    change the time of the directory """
+    if os.path.isdir(foutp):
+        foutp = os.path.join(foutp, 'header.json')
+        if not os.path.exists(foutp):
+            return -1
+    return os.stat(foutp).st_mtime
+
+
+def list_files(path, recursive=False, _seen=None):
+    """ Entries of a directory in name order, descending into
+    subdirectories if recursive, each directory only once so that symbolic
+    links to a parent directory don't loop """
+    st = os.stat(path)
+    if _seen is None:
+        _seen = set()
+    elif (st.st_dev, st.st_ino) in _seen:
+        return
+    _seen.add((st.st_dev, st.st_ino))
+    try:
+        entries = sorted(os.scandir(path), key=lambda e: e.name)
+    except AttributeError:
+        # python 2
+        entries = [_Entry(path, name) for name in sorted(os.listdir(path))]
+    for entry in entries:
+        if recursive and entry.is_dir():
+            for fpath in list_files(entry.path, recursive, _seen):
+                yield fpath
+        else:
+            yield entry.path
+
+
+class _Entry(object):
+    """ Stand in for os.DirEntry """
+
+    def __init__(self, folder, name):
+        self.name = name
+        self.path = os.path.join(folder, name)
+
+    def is_dir(self):
+        return os.path.isdir(self.path)
+
+
+def load_manifest(path):
+    """ Manifest entries by input file, empty if there is no manifest """
+    if not path or not os.path.isfile(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)['files']
+
+
+def save_manifest(path, files):
+    """ Write the manifest, replacing the old one only once it is written """
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump({'files': files}, f, indent=1, sort_keys=True)
+    # os.rename doesn't replace files on windows
+    getattr(os, 'replace', os.rename)(tmp, path)
+
+
+def _process(task, **kwargs):
+    """ process_file for a (path, manifest entry) task """
+    fpath, entry = task
+    return process_file(fpath, entry=entry, **kwargs)
+
 
 def main():
-    desc = 'Converts *.spc binary files to text using the spc module'
+    desc = 'Converts *.spc binary files to text or NumPy files using the spc module'
     parser = argparse.ArgumentParser(description=desc)
     parser.add_argument('filefolder', nargs='+', help='Input *.spc files or directory')
     fformat = parser.add_mutually_exclusive_group()
@@ -20,11 +188,31 @@ def main():
                          action='store_true')
     fformat.add_argument('-t', '--txt', help='Tab separated output file (.txt)',
                          action='store_true')
+    fformat.add_argument('-z', '--npz', help='NumPy archive output file (.npz)',
+                         action='store_true')
+    fformat.add_argument('--npy', help='Directory of NumPy .npy files, named after the input file '
+                         'with _npy added',
+                         action='store_true')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='Number of files to convert in parallel, 0 to use all cores [default: 1]')
+    parser.add_argument('-r', '--recursive', action='store_true',
+                        help='Convert the files in subdirectories of directories too')
+    parser.add_argument('-u', '--update', action='store_true',
+                        help='Skip files whose output is newer than the file, or with a '
+                        'manifest, whose output was made from a file with the same contents')
+    parser.add_argument('-m', '--manifest',
+                        help='JSON file recording the size, time and SHA-1 hash of each '
+                        'converted file, and its output, updated after each run')
     args = parser.parse_args()
 
+    delim = None
     if args.txt:
         exten = '.txt'
         delim = '\t'
+    elif args.npz:
+        exten = '.npz'
+    elif args.npy:
+        exten = NPY_EXTEN
     else:
         # defaults
         exten = '.csv'
@@ -37,25 +225,62 @@ def main():
         ffn = os.path.abspath(fn)
         # or directories
         if os.path.isdir(ffn):
-            for f in os.listdir(ffn):
-                flist.append(os.path.join(ffn, f))
+            flist.extend(list_files(ffn, args.recursive))
         else:
             flist.append(ffn)
 
+    spc_list = [fpath for fpath in flist if fpath.lower().endswith('spc')]
+    manifest = load_manifest(args.manifest)
+    tasks = [(fpath, manifest.get(fpath)) for fpath in spc_list]
+    convert = functools.partial(_process, exten=exten, delim=delim, update=args.update,
+                                record=args.manifest is not None)
+
+    jobs = args.jobs if args.jobs > 0 else multiprocessing.cpu_count()
+    pool = None
+    if jobs > 1 and len(spc_list) > 1:
+        pool = multiprocessing.Pool(min(jobs, len(spc_list)))
+        # imap keeps the input order, so the report is the same for any
+        # number of jobs
+        results = pool.imap(convert, tasks, chunksize=4)
+    else:
+        results = (convert(task) for task in tasks)
+
     # process files
-    for fpath in flist:
-        if fpath.lower().endswith('spc'):
-
-            foutp = fpath[:-4] + exten
-            try:
-                print(fpath, end=' ')
-                f = spc.File(fpath)
-                f.write_file(foutp, delimiter=delim)
-                print('Converted')
-            except:
-                print('Error processing %s' % fpath)
-        else:
-            print('%s not spc file, skipping' % fpath)
+    nconv = nerr = nskip = nupd = 0
+    try:
+        for fpath in flist:
+            if fpath.lower().endswith('spc'):
+                state, status, entry = next(results)
+                print(fpath, status)
+                if state == 'converted':
+                    nconv += 1
+                elif state == 'skipped':
+                    nupd += 1
+                else:
+                    nerr += 1
+                if entry is not None:
+                    manifest[fpath] = entry
+            else:
+                print('%s not spc file, skipping' % fpath)
+                nskip += 1
+    except BaseException:
+        if pool is not None:
+            # e.g. interrupted, don't wait for the remaining files
+            pool.terminate()
+            pool.join()
+        raise
+    else:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    finally:
+        if args.manifest:
+            # also when interrupted, so the files converted so far are kept
+            save_manifest(args.manifest, manifest)
+
+    print('Converted %i of %i spc files (%i up to date, %i errors, %i other files skipped)'
+          % (nconv, len(spc_list), nupd, nerr, nskip))
+
 
 if __name__ == '__main__':
     main()
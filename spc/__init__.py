@@ -2,7 +2,20 @@
 Module for reading, exploring and converting SPC spectroscopic binary data in Python.
 """
 
-from .spc import File
+import logging
+
+from .spc import File, iter_subfiles, load_many, read_header
+from .writer import write
+from .cache import FileCache
+
+try:
+    from .aio import aload, aload_many
+except (ImportError, SyntaxError):
+    # asyncio loading needs python 3
+    pass
+
+# quiet unless the application configures logging
+logging.getLogger(__name__).addHandler(logging.NullHandler())
 
 __author__ = "Rohan Isaac"
 __author_email__ = "rohan_isaac@yahoo.com"
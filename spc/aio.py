@@ -0,0 +1,123 @@
+"""
+asyncio loading: loads files in an executor so the event loop is not blocked
+by the file I/O or decoding. Python 3 only.
+
+author: Rohan Isaac
+"""
+
+from __future__ import division, absolute_import, unicode_literals, print_function
+
+import asyncio
+import collections
+import functools
+
+from .spc import File
+
+
+async def aload(filename, executor=None, **kwargs):
+    """
+    Load a .SPC file without blocking the event loop
+
+    Arguments
+    ---------
+    filename: str
+        path to the .SPC file
+    executor: concurrent.futures.Executor (default=None)
+        executor to load in, the event loop default (thread pool) if None
+    **kwargs:
+        passed on to File, e.g. mmap or stats
+
+    Returns
+    -------
+    File
+
+    Example
+    -------
+    >>> f = await spc.aload('/path/to/ftir.spc')
+    """
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(executor, functools.partial(File, filename, **kwargs))
+
+
+def aload_many(filenames, concurrency=4, executor=None, return_exceptions=False, **kwargs):
+    """
+    Load many .SPC files without blocking the event loop, at most concurrency
+    at a time, giving each file as soon as it is loaded
+
+    Arguments
+    ---------
+    filenames: iterable of str
+        paths to the .SPC files, only taken when there is room to load them
+    concurrency: int (default=4)
+        number of files loaded at the same time, this also bounds the number
+        of loaded files waiting to be taken
+    executor: concurrent.futures.Executor (default=None)
+        executor to load in, the event loop default (thread pool) if None
+    return_exceptions: bool (default=False)
+        give the exception instead of the File for files that fail to load,
+        otherwise the exception is raised
+    **kwargs:
+        passed on to File, e.g. mmap or stats
+
+    Returns
+    -------
+    asynchronous iterator of (filename, File) tuples, in the order the files
+    finish loading
+
+    Example
+    -------
+    >>> async for path, f in spc.aload_many(paths, concurrency=8):
+    ...     await store(path, f.y_matrix)
+    """
+    if concurrency < 1:
+        raise ValueError("concurrency must be at least 1")
+    return _aloadIter(filenames, concurrency, executor, return_exceptions, kwargs)
+
+
+class _aloadIter(object):
+    """ Asynchronous iterator behind aload_many """
+
+    def __init__(self, filenames, concurrency, executor, return_exceptions, kwargs):
+        self._filenames = iter(filenames)
+        self._concurrency = concurrency
+        self._executor = executor
+        self._return_exceptions = return_exceptions
+        self._kwargs = kwargs
+        # futures being loaded, and their file names
+        self._pending = dict()
+        # loaded but not taken yet
+        self._done = collections.deque()
+
+    def __aiter__(self):
+        return self
+
+    def _fill(self):
+        """ Start loading files until concurrency files are in flight """
+        loop = asyncio.get_event_loop()
+        # loaded files stay in pending until they are taken
+        while len(self._pending) < self._concurrency:
+            try:
+                filename = next(self._filenames)
+            except StopIteration:
+                break
+            fut = loop.run_in_executor(self._executor,
+                                       functools.partial(File, filename, **self._kwargs))
+            self._pending[fut] = filename
+
+    async def __anext__(self):
+        self._fill()
+        if not self._done:
+            if not self._pending:
+                raise StopAsyncIteration
+            done, _ = await asyncio.wait(list(self._pending),
+                                         return_when=asyncio.FIRST_COMPLETED)
+            self._done.extend(done)
+
+        fut = self._done.popleft()
+        filename = self._pending.pop(fut)
+        try:
+            return filename, fut.result()
+        except Exception as e:
+            if self._return_exceptions:
+                return filename, e
+            raise
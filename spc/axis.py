@@ -0,0 +1,205 @@
+"""
+evenAxis class: evenly spaced x-data, stored as its first value, spacing and
+number of points
+
+author: Rohan Isaac
+"""
+
+from __future__ import division, absolute_import, unicode_literals, print_function
+
+import numpy as np
+from numpy.lib.mixins import NDArrayOperatorsMixin
+
+
+class evenAxis(NDArrayOperatorsMixin):
+    """
+    Evenly spaced values from first to last, used for the x-data of files
+    that only store the range (gx-y and the old format). Behaves like the
+    read-only array np.linspace(first, last, n) (indexing, len, arithmetic and
+    numpy functions), which is only created when the values are needed. Slices
+    are evenAxis objects too, and finding the index of a value takes no search.
+    In-place operators such as f.x += 1 replace it with a new array.
+
+    Data
+    ----
+    first: first value
+    last: last value
+    spacing: difference between neighbouring values
+    values: the values as an array, created on first access
+
+    Example
+    -------
+    >>> x = evenAxis(400.0, 4000.0, 1000)
+    >>> x[10], x.index(1200.0)
+    (436.03603603603603, 222)
+    >>> i, j = x.searchsorted([1000.0, 2000.0])
+    >>> f.y_matrix[:, i:j]  # y-data between 1000 and 2000
+    """
+
+    def __init__(self, first, last, n, dtype=np.float64):
+        self._start = float(first)
+        self._stop = float(last)
+        self._nbase = int(n)
+        self._step = (self._stop - self._start) / (n - 1) if n > 1 else 0.0
+        # indices into the full range, for slices
+        self._i0 = 0
+        self._k = 1
+        self._n = int(n)
+        self.dtype = np.dtype(dtype)
+        self._values = None
+
+    # ------------------------------------------------------------------------
+    # Values
+    # ------------------------------------------------------------------------
+
+    def _value(self, i):
+        """ Values at indices i of the full range, computed the same way as
+        np.linspace """
+        v = np.asarray(i, np.float64) * self._step + self._start
+        # the end is exact
+        return np.where(np.asarray(i) == self._nbase - 1, self._stop, v)
+
+    def _at(self, idx):
+        """ Values at indices idx of this axis """
+        return self._value(self._i0 + self._k * np.asarray(idx)).astype(self.dtype)
+
+    @property
+    def values(self):
+        if self._values is None:
+            values = self._value(self._i0 + self._k * np.arange(self._n))
+            self._values = values.astype(self.dtype, copy=False)
+            # edits would not be seen by the computed values
+            self._values.flags.writeable = False
+        return self._values
+
+    @property
+    def first(self):
+        return self[0]
+
+    @property
+    def last(self):
+        return self[-1]
+
+    @property
+    def spacing(self):
+        return self._step * self._k
+
+    # ------------------------------------------------------------------------
+    # Array interface
+    # ------------------------------------------------------------------------
+
+    ndim = 1
+
+    @property
+    def shape(self):
+        return (self._n,)
+
+    @property
+    def size(self):
+        return self._n
+
+    def __len__(self):
+        return self._n
+
+    def __array__(self, dtype=None, copy=None):
+        values = self.values
+        if dtype is not None:
+            values = values.astype(dtype, copy=False)
+        if copy:
+            values = values.copy()
+        return values
+
+    def __array_ufunc__(self, ufunc, method, *inputs, **kwargs):
+        inputs = tuple(np.asarray(i) if isinstance(i, evenAxis) else i for i in inputs)
+        if any(isinstance(o, evenAxis) for o in kwargs.get('out', ())):
+            # read-only, so compute a new array instead: f.x += 1 makes f.x
+            # that array
+            kwargs['out'] = tuple(None if isinstance(o, evenAxis) else o for o in kwargs['out'])
+        return getattr(ufunc, method)(*inputs, **kwargs)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self._n)
+            sub = evenAxis.__new__(evenAxis)
+            sub.__dict__.update(self.__dict__)
+            sub._i0 = self._i0 + start * self._k
+            sub._k = self._k * step
+            sub._n = len(range(start, stop, step))
+            sub._values = None
+            return sub
+        if isinstance(key, (int, np.integer)):
+            if not -self._n <= key < self._n:
+                raise IndexError("index %i is out of bounds for axis with size %i"
+                                 % (key, self._n))
+            return self.dtype.type(self._at(key % self._n))
+        # fancy indexing
+        return self.values[key]
+
+    def __setitem__(self, key, value):
+        raise TypeError("evenAxis is read-only, use np.array(x) for a modifiable copy")
+
+    def __iter__(self):
+        return iter(self.values)
+
+    def __repr__(self):
+        return 'evenAxis(first=%r, last=%r, n=%i)' % (
+            float(self.first), float(self.last), self._n) if self._n else 'evenAxis(n=0)'
+
+    def __getattr__(self, name):
+        # other array attributes and methods (sum, mean, reshape, T, ...)
+        # are those of the values
+        if name.startswith('_'):
+            raise AttributeError("'evenAxis' object has no attribute '%s'" % name)
+        return getattr(self.values, name)
+
+    def copy(self, order='C'):
+        """ Values as a new array """
+        return self.values.copy(order)
+
+    def astype(self, dtype, *args, **kwargs):
+        """ Values as an array of dtype, as ndarray.astype """
+        return self.values.astype(dtype, *args, **kwargs)
+
+    def min(self, axis=None, out=None, **kwargs):
+        """ Smallest value, as ndarray.min, without creating the values """
+        if axis not in (None, 0, -1) or out is not None or kwargs or not self._n:
+            return self.values.min(axis=axis, out=out, **kwargs)
+        return min(self.first, self.last)
+
+    def max(self, axis=None, out=None, **kwargs):
+        """ Largest value, as ndarray.max, without creating the values """
+        if axis not in (None, 0, -1) or out is not None or kwargs or not self._n:
+            return self.values.max(axis=axis, out=out, **kwargs)
+        return max(self.first, self.last)
+
+    # ------------------------------------------------------------------------
+    # Index of values
+    # ------------------------------------------------------------------------
+
+    def index(self, value):
+        """ Index of the value closest to value, for a scalar or an array of
+        values """
+        if self.spacing == 0:
+            return np.zeros(np.shape(value), int)[()]
+        i = np.rint((np.asarray(value, np.float64) - self.first) / self.spacing)
+        return np.clip(i, 0, self._n - 1).astype(int)[()]
+
+    def searchsorted(self, value, side='left', sorter=None):
+        """ Index to insert value at to keep the order, as np.searchsorted,
+        for increasing axes """
+        value = np.asarray(value, np.float64)
+        if self._n == 0 or self.spacing <= 0 or sorter is not None:
+            # nothing to compute from, same as np.searchsorted on the values
+            return np.searchsorted(self.values, value, side, sorter)
+        guess = np.floor((value - self.first) / self.spacing)
+        idx = np.clip(guess, 0, self._n).astype(int)
+        # the guess can be one off due to rounding, check the neighbours
+        for _ in range(2):
+            below = idx > 0
+            prev = self._at(np.maximum(idx - 1, 0))
+            idx = idx - (below & ((prev >= value) if side == 'left' else (prev > value)))
+        for _ in range(2):
+            above = idx < self._n
+            cur = self._at(np.minimum(idx, self._n - 1))
+            idx = idx + (above & ((cur < value) if side == 'left' else (cur <= value)))
+        return idx[()]
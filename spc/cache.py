@@ -0,0 +1,313 @@
+"""
+FileCache class: keeps loaded files in memory, and optionally their decoded
+data on disk, so opening the same file again is fast
+
+author: Rohan Isaac
+"""
+
+from __future__ import division, absolute_import, unicode_literals, print_function
+
+import collections
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+import numpy as np
+
+from .axis import evenAxis
+from .spc import File
+from .sub import subFile
+
+
+class FileCache(object):
+    """
+    Cache of loaded .SPC files. Files are looked up by path, and only used if
+    the size and modification time of the file have not changed, otherwise the
+    file is loaded again.
+
+    The least recently used files are dropped from memory once the decoded
+    data takes more than max_bytes. If a directory is given, the decoded data
+    of each file is also stored there as .npy files, which are memory mapped
+    when the file is next opened (e.g. in a new session).
+
+    Files are shared by everyone loading them from the cache, so should not be
+    modified in place.
+
+    Arguments
+    ---------
+    max_bytes: int (default=1GB)
+        memory the decoded data of the files kept in memory can take
+    directory: str (default=None)
+        directory to store decoded data in, created if needed, None to only
+        cache in memory
+    mmap_mode: str (default='c')
+        mode to memory map data stored on disk with, see np.load; the default
+        copy-on-write maps give writable arrays without changing the cache
+
+    Data
+    ----
+    nbytes: memory taken by the files in memory
+    counts: number of loads from memory, from disk, and of files that had
+        to be loaded ('memory', 'disk', 'miss')
+
+    Example
+    -------
+    >>> cache = spc.FileCache(max_bytes=2**30, directory='/tmp/spc_cache')
+    >>> f = cache.load('/path/to/map.spc')
+    >>> f = cache.load('/path/to/map.spc')  # no reading or decoding
+    """
+
+    # layout of the entries on disk, entries with another version are ignored
+    version = 1
+
+    def __init__(self, max_bytes=2**30, directory=None, mmap_mode='c'):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.mmap_mode = mmap_mode
+        self.nbytes = 0
+        self.counts = {'memory': 0, 'disk': 0, 'miss': 0}
+        # path -> (key, File, nbytes), least recently used first
+        self._files = collections.OrderedDict()
+        self._lock = threading.Lock()
+        if directory is not None and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def __len__(self):
+        return len(self._files)
+
+    def load(self, filename):
+        """ Load a .SPC file from the cache, loading (and caching) it if it is
+        not there or has changed
+
+        Arguments
+        ---------
+        filename: str
+            path to the .SPC file
+
+        Returns
+        -------
+        File
+        """
+        path = os.path.abspath(filename)
+        key = _file_key(path)
+        with self._lock:
+            entry = self._files.pop(path, None)
+            if entry is not None:
+                if entry[0] == key:
+                    # move to the most recently used end
+                    self._files[path] = entry
+                    self.counts['memory'] += 1
+                    return entry[1]
+                # file has changed
+                self.nbytes -= entry[2]
+
+        f = None
+        if self.directory is not None:
+            f = self._load_disk(path, key)
+        if f is None:
+            f = File(path)
+            if self.directory is not None:
+                self._save_disk(path, key, f)
+            source = 'miss'
+        else:
+            source = 'disk'
+
+        with self._lock:
+            self.counts[source] += 1
+            self._add(path, key, f)
+        return f
+
+    def clear(self, disk=False):
+        """ Drop all files from memory, and from the directory if disk is
+        set """
+        with self._lock:
+            self._files.clear()
+            self.nbytes = 0
+        if disk and self.directory is not None:
+            for name in os.listdir(self.directory):
+                shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+
+    # ------------------------------------------------------------------------
+    # Memory
+    # ------------------------------------------------------------------------
+
+    def _add(self, path, key, f):
+        """ Keep a file in memory, dropping the least recently used files to
+        stay within max_bytes """
+        nbytes = _nbytes(f)
+        if nbytes > self.max_bytes:
+            # would push everything else out
+            return
+        self._files[path] = (key, f, nbytes)
+        self.nbytes += nbytes
+        while self.nbytes > self.max_bytes:
+            _, (_, _, n) = self._files.popitem(last=False)
+            self.nbytes -= n
+
+    # ------------------------------------------------------------------------
+    # Disk
+    # ------------------------------------------------------------------------
+
+    def _entry_dir(self, path):
+        """ Directory holding the decoded data of the file at path """
+        return os.path.join(self.directory, hashlib.sha1(path.encode('utf8')).hexdigest())
+
+    def _save_disk(self, path, key, f):
+        """ Store the decoded data, and the raw header and log needed to
+        recreate the File """
+        if not getattr(f, 'sub', None) or f.fversn == b'\xcf' or \
+                (f.dat_fmt != '-xy' and f.y_matrix is None):
+            # unsupported format, Shimadzu (no header to recreate the File
+            # from), or subfiles of different lengths
+            return
+
+        with open(path, 'rb') as fin:
+            head = fin.read(File.head_siz)
+            log = b''
+            if getattr(f, 'flogoff', 0):
+                fin.seek(f.flogoff)
+                log = fin.read(f.logtxto + f.logsizd)
+        if _file_key(path) != key:
+            # changed while it was being loaded
+            return
+
+        tmp = tempfile.mkdtemp(dir=self.directory)
+        try:
+            for name, arr in f._export_arrays().items():
+                np.save(os.path.join(tmp, name + '.npy'), arr)
+            np.save(os.path.join(tmp, 'sub_index.npy'), f.sub_index)
+            with open(os.path.join(tmp, 'head.bin'), 'wb') as fout:
+                fout.write(head)
+            with open(os.path.join(tmp, 'log.bin'), 'wb') as fout:
+                fout.write(log)
+            meta = {'version': self.version, 'path': path, 'key': key, 'length': f.length}
+            if f.dat_fmt == '-xy':
+                # joining the subfiles mixes integer and floating y-data
+                meta['y_dtypes'] = [s.y.dtype.str for s in f.sub]
+            # written last, entries without it are incomplete
+            with open(os.path.join(tmp, 'meta.json'), 'w') as fout:
+                json.dump(meta, fout)
+
+            entry = self._entry_dir(path)
+            shutil.rmtree(entry, ignore_errors=True)
+            os.rename(tmp, entry)
+        except (IOError, OSError):
+            # e.g. another process stored it first, the cache is optional
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    def _load_disk(self, path, key):
+        """ Recreate the File from the directory, None if it is not there or
+        out of date """
+        entry = self._entry_dir(path)
+        try:
+            with open(os.path.join(entry, 'meta.json')) as fin:
+                meta = json.load(fin)
+        except (IOError, OSError, ValueError):
+            return None
+        if meta.get('version') != self.version or meta.get('path') != path \
+                or meta.get('key') != key:
+            # stale
+            shutil.rmtree(entry, ignore_errors=True)
+            return None
+
+        try:
+            with open(os.path.join(entry, 'head.bin'), 'rb') as fin:
+                head = fin.read()
+            with open(os.path.join(entry, 'log.bin'), 'rb') as fin:
+                log = fin.read()
+            arrays = dict()
+            for name in ('x', 'y', 'subheaders', 'npts', 'sub_index'):
+                fname = os.path.join(entry, name + '.npy')
+                if os.path.isfile(fname):
+                    arrays[name] = _load_npy(fname, self.mmap_mode)
+        except (IOError, OSError, ValueError):
+            shutil.rmtree(entry, ignore_errors=True)
+            return None
+        return _from_arrays(head, log, meta, arrays)
+
+
+# ------------------------------------------------------------------------
+# Helpers
+# ------------------------------------------------------------------------
+
+
+def _file_key(path):
+    """ Size and modification time of a file, which change when it does """
+    st = os.stat(path)
+    return [st.st_size, getattr(st, 'st_mtime_ns', st.st_mtime)]
+
+
+def _nbytes(f):
+    """ Memory taken by the x and y data of a File """
+    arrays = [getattr(f, 'x', None), f._y_matrix]
+    if f._y_matrix is None:
+        for s in getattr(f, 'sub', []):
+            # decoded data of subFile or subFileOld
+            arrays.extend(vars(s).get(k) for k in ('_x', '_y', 'x', 'y'))
+    # subfiles can share their x-data
+    arrays = dict((id(a), a) for a in arrays if isinstance(a, np.ndarray))
+    return sum(a.nbytes for a in arrays.values())
+
+
+def _load_npy(fname, mmap_mode):
+    """ Memory map a .npy file, empty arrays can't be mapped """
+    arr = np.load(fname, mmap_mode=mmap_mode)
+    if arr.size == 0:
+        arr = np.load(fname)
+    return arr
+
+
+def _from_arrays(head, log, meta, arrays):
+    """ File from its raw header and log block, the cache entry metadata and
+    the arrays written by File._export_arrays """
+    f = File._from_header(head, meta['length'])
+    f.stats = None
+    f._dtype = None
+    f.mmap = False
+    f._mmap = None
+    f._buf = None
+    f._y_matrix = None
+    f._points = None
+    f._x_from = None
+    f.sub_index = arrays['sub_index']
+
+    if log:
+        f._read_log_head(log[:File.log_siz])
+        f._read_log_text(log[f.logtxto:f.logtxto + f.logsizd])
+
+    x, y, subheaders = arrays['x'], arrays['y'], arrays['subheaders']
+    if f.dat_fmt == '-xy':
+        if f.fnpts > 0:
+            f.directory = True
+        # split the joined subfiles up again
+        ends = np.cumsum(arrays['npts']).tolist()
+        starts = [0] + ends[:-1]
+        xs = [x[i:j] for i, j in zip(starts, ends)]
+        for k in range(1, len(xs)):
+            # share the x-data of the subfile before if it is the same
+            if np.array_equal(xs[k], xs[k - 1]):
+                xs[k - 1].flags.writeable = False
+                xs[k] = xs[k - 1]
+        f.sub = [subFile._from_decoded(h, sx, y[i:j].astype(dt, copy=False))
+                 for h, sx, i, j, dt in zip(subheaders, xs, starts, ends, meta['y_dtypes'])]
+        f.common_x = len(xs) > 0 and all(sx is xs[0] for sx in xs)
+        if f.common_x:
+            f.x = xs[0]
+    else:
+        f.common_x = True
+        # evenly spaced x-data is an evenAxis, as when loaded from the file
+        if f.fversn == b'\x4d':
+            f.x = evenAxis(f.ofirst, f.olast, f.onpts)
+        elif not f.txvals:
+            f.x = evenAxis(f.ffirst, f.flast, f.fnpts)
+        else:
+            f.x = x
+        f._y_matrix = y
+        f.sub = [subFile._from_decoded(h, None, row) for h, row in zip(subheaders, y)]
+    # the old format doesn't store the number of subfiles
+    f.fnsub = len(f.sub)
+    f.sub_numbers = np.arange(f.fnsub)
+    return f
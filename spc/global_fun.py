@@ -5,13 +5,14 @@ author: Rohan Isaac
 """
 from __future__ import division, absolute_import, unicode_literals, print_function
 import struct
+import numpy as np
 
 # ------------------------------------------------------------------------
 # Process subfile data
 # ------------------------------------------------------------------------
 
 
-def read_subheader(subheader):
+def read_subheader(subheader, endian='<'):
     """
     Return the subheader as a list
 
@@ -19,6 +20,8 @@ def read_subheader(subheader):
     ----------
     subheader (string):
         32 character string in the subheader format
+    endian (string):
+        byte order, '<' for little-endian (LSB) and '>' for big-endian (MSB)
 
     Returns
     -------
@@ -36,7 +39,7 @@ def read_subheader(subheader):
         [9] subresv
     """
 
-    subhead_str = "<cchfffiif4s"
+    subhead_str = endian + "cchfffiif4s"
     items = struct.unpack(subhead_str.encode('utf8'), subheader)
 
     item_cpy = [ord(i) for i in items[:2]]
@@ -44,6 +47,203 @@ def read_subheader(subheader):
 
     return item_cpy
 
+# ------------------------------------------------------------------------
+# Scale integer data by the exponent
+# ------------------------------------------------------------------------
+
+
+def scale_data(raw, shift, out=None):
+    """
+    Return integer data scaled by 2**shift
+
+    Parameters
+    ----------
+    raw (ndarray):
+        integer data as read from the file
+    shift (int):
+        power of two to scale by, e.g. exp - 32 for 32 bit data
+    out (ndarray):
+        optional array to write the result into
+
+    Returns
+    -------
+    ndarray:
+        float64 array, or int64 if the scale factor is a whole number
+    """
+    if out is None:
+        out = np.empty(raw.shape, scale_dtype(shift))
+    out[...] = raw
+    out *= 2**shift
+    return out
+
+
+def convert_data(raw, shift, dtype, out=None, view=False):
+    """
+    Return data as read from the file as dtype, scaling integer data by
+    2**shift
+
+    Parameters
+    ----------
+    raw (ndarray):
+        data as read from the file
+    shift (int):
+        power of two to scale by, None to only convert (floating data, or
+        integers that are kept as they are)
+    dtype (dtype):
+        dtype of the result
+    out (ndarray):
+        optional array to write the result into, instead of dtype
+    view (bool):
+        return raw itself if it already has the type (in any byte order)
+
+    Returns
+    -------
+    ndarray
+    """
+    if out is None:
+        if view and raw.dtype.kind == dtype.kind and raw.dtype.itemsize == dtype.itemsize:
+            return raw
+        out = np.empty(raw.shape, dtype)
+    if shift is None:
+        out[...] = raw
+        return out
+    return scale_data(raw, shift, out)
+
+
+def scale_dtype(shift):
+    """ Return the dtype `scale_data` produces for a given shift """
+    if shift < 0:
+        return np.dtype(np.float64)
+    return np.dtype(np.int64)
+
+# ------------------------------------------------------------------------
+# Format columns of data as text
+# ------------------------------------------------------------------------
+
+
+def text_chunks(columns, delimiter='\t', newline='\n', fmt=None, chunk_cells=2**16):
+    """
+    Generate text for columns of data, a block of rows at a time
+
+    Parameters
+    ----------
+    columns (list of ndarray):
+        data for each column, rows past the end of the shortest column are
+        dropped
+    delimiter (string):
+        delimiter character for column separation
+    newline (string):
+        newline character
+    fmt (string):
+        optional printf style format for every value, e.g. '%.6g'. By
+        default values are formatted the same as '{}'.format(value)
+    chunk_cells (int):
+        approximate number of values formatted per chunk
+
+    Yields
+    ------
+    string:
+        text for a block of rows, each ending with newline
+    """
+    npts = min(len(c) for c in columns)
+    step = max(1, chunk_cells // len(columns))
+
+    if fmt is not None:
+        row_fmt = delimiter.join([fmt] * len(columns)) + newline
+
+    for start in range(0, npts, step):
+        stop = min(start + step, npts)
+        if fmt is None:
+            # tolist gives python scalars, formatted like the numpy ones
+            cols = [map('{}'.format, np.asarray(c[start:stop]).tolist()) for c in columns]
+            yield newline.join(map(delimiter.join, zip(*cols))) + newline
+        else:
+            block = np.column_stack([c[start:stop] for c in columns])
+            yield (row_fmt * (stop - start)) % tuple(block.ravel().tolist())
+
+# ------------------------------------------------------------------------
+# Interpolate rows of different lengths onto a common grid
+# ------------------------------------------------------------------------
+
+
+def interp_rows(grid, xs, ys, left=np.nan, right=np.nan):
+    """
+    Linearly interpolate rows of (x, y) data onto the same grid, giving the
+    same values as np.interp on each row. Rows sharing the same x array are
+    interpolated together, finding the points either side of the grid once
+    for all of them
+
+    Parameters
+    ----------
+    grid (ndarray):
+        x values to interpolate at
+    xs, ys (list of ndarray):
+        x and y values of each row, rows can be different lengths and x does
+        not have to be sorted
+    left, right (float):
+        value for grid points before the first or after the last x value of a
+        row (or for all points of an empty row)
+
+    Returns
+    -------
+    ndarray:
+        (len(ys), len(grid)) float64 array
+    """
+    grid = np.asarray(grid, np.float64)
+    out = np.empty((len(ys), len(grid)), np.float64)
+
+    # group the rows by x array
+    groups = dict()
+    for i, x in enumerate(xs):
+        groups.setdefault(id(x), (x, []))[1].append(i)
+
+    for x, rows in groups.values():
+        x = np.asarray(x, np.float64)
+        if len(x) == 0:
+            out[rows] = left
+            continue
+        # sort x, usually it is increasing or decreasing already
+        if x[0] > x[-1] and np.all(x[1:] <= x[:-1]):
+            order = slice(None, None, -1)
+        elif np.all(x[1:] >= x[:-1]):
+            order = slice(None)
+        else:
+            order = np.argsort(x, kind='mergesort')
+        x = x[order]
+
+        if len(rows) == 1:
+            out[rows[0]] = np.interp(grid, x, np.asarray(ys[rows[0]])[order], left, right)
+            continue
+
+        y = np.array([ys[i] for i in rows], np.float64)[:, order]
+        # points either side of each grid point, as np.interp
+        j = np.searchsorted(x, grid, 'right')
+        lo = np.clip(j - 1, 0, len(x) - 1)
+        hi = np.clip(j, 0, len(x) - 1)
+        dx = x[hi] - x[lo]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            w = np.where(dx != 0, (grid - x[lo]) / dx, 0.0)
+        if len(x) <= 256 and np.all(np.isfinite(y)):
+            # short rows, faster as a product with the weight of each point
+            weights = np.zeros((len(x), len(grid)))
+            cols = np.arange(len(grid))
+            np.add.at(weights, (lo, cols), 1 - w)
+            np.add.at(weights, (hi, cols), w)
+            res = np.dot(y, weights)
+        else:
+            res = y[:, lo]
+            step = y[:, hi]
+            step -= res
+            step *= w
+            res += step
+            # exactly on a point, as np.interp even if the next is nan
+            on = w == 0
+            res[:, on] = y[:, lo[on]]
+        res[:, j == 0] = left
+        res[:, grid > x[-1]] = right
+        out[rows] = res
+    return out
+
 # ------------------------------------------------------------------------
 # Decode a character to boolean array
 # ------------------------------------------------------------------------
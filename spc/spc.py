@@ -6,29 +6,80 @@ author: Rohan Isaac
 """
 
 from __future__ import division, absolute_import, unicode_literals, print_function
+import json
+import logging
+import mmap as mmap_
+import os
 import struct
+import threading
+from functools import partial, reduce
+from multiprocessing.pool import ThreadPool
 import numpy as np
 
-from .sub import subFile, subFileOld
-from .global_fun import read_subheader, flag_bits
+from .axis import evenAxis
+from .sub import subFile, subFileOld, subList
+from .global_fun import read_subheader, flag_bits, text_chunks, interp_rows
+from .stats import loadStats
 
+logger = logging.getLogger(__name__)
 
-class File:
+
+class File(object):
     """
     Starts loading the data from a .SPC spectral file using data from the
     header. Stores all the attributes of a spectral file:
 
+    Arguments
+    ---------
+    filename: str
+        path to the .SPC file
+    mmap: bool (default=False)
+        memory map the file instead of reading it into memory. Subfiles are
+        then only read (using sub_index) when sub[i] is first accessed, their
+        data only decoded on first access of sub[i].x or sub[i].y, and
+        floating point y-data is a read-only float32 view into the file
+    stats: bool (default=False)
+        collect load timings and sizes in stats
+    dtype: str or dtype (default=None)
+        type of the decoded data: None for float64 (int64 for integer data
+        scaled by a whole number), 'native' for the smallest float holding the
+        stored data exactly (float32 for floating and 16 bit y-data and global
+        x-data), 'raw' for the y-data as stored in the file (multiply by
+        sub[i].y_scale to scale it, x-data is scaled as for None), or a
+        floating point type such as np.float32
+    x_range: (float, float) (default=None)
+        only load the points with x-data between these values, only decoding
+        the y-data of those points (and with mmap only reading it). Needs
+        global x-data (not -xy)
+    subs: slice or list of int (default=None)
+        only load these subfiles, e.g. slice(0, 100)
+
     Data
     ----
     content: Full raw data
     sub[i]: sub file object for each subfileFor each subfile
         sub[i].y: y data for each subfile
-    x: x-data, global, or for the first subheader
+    x: x-data, global, or shared by all subfiles of -xy files with common_x
+    common_x: True if all subfiles have the same x-data, for -xy files their
+        subfiles then share one read-only x array (consecutive subfiles with
+        the same x-data always share it). For memory mapped files subfiles
+        are compared with their neighbours as they are read, and common_x
+        is only worked out when it, x or y_matrix is used
+    y_matrix: y-data of all subfiles as one array, if they share x-data
+    sub_index: byte offset and size of each subfile in the file
+    sub_numbers: number of each loaded subfile in the file, all of them
+        unless subs was given
+    stats: loadStats object if stats was set, otherwise None
+
+    Progress and problems are reported with the logging module, using the
+    'spc' logger, which is quiet unless logging is configured
 
     Examples
     --------
     >>> import spc
     >>> ftir_1 = spc.File('/path/to/ftir.spc')
+    >>> with spc.File('/path/to/map.spc', mmap=True) as big_map:
+    ...     y = big_map.sub[10].y
     """
 
     # Format strings for various parts of the file
@@ -37,6 +88,14 @@ class File:
     old_head_str = "<cchfffcchcccc8shh28s130s30s32s"
     logstc_str = "<iiiii44s"
 
+    # subfile directory entry, and the index of subfile positions in the file
+    dir_dtype = np.dtype([('ssfposn', '<i4'), ('ssfsize', '<i4'), ('ssftime', '<f4')])
+    index_dtype = np.dtype([('offset', np.int64), ('size', np.int64)])
+    subhead_dtype = np.dtype([('subflgs', 'u1'), ('subexp', 'u1'), ('subindx', '<i2'),
+                              ('subtime', '<f4'), ('subnext', '<f4'), ('subnois', '<f4'),
+                              ('subnpts', '<i4'), ('subscan', '<i4'), ('subwlevel', '<f4'),
+                              ('subresv', 'S4')])
+
     # byte positon of various parts of the file
     head_siz = 512
     old_head_siz = 256
@@ -45,118 +104,52 @@ class File:
 
     subhead1_pos = head_siz + subhead_siz
 
+    # start of the data in Shimadzu files
+    shimadzu_pos = 10240
+
     # ------------------------------------------------------------------------
     # CONSTRUCTOR
     # ------------------------------------------------------------------------
 
-    def __init__(self, filename):
-        # load entire into memory temporarly
+    def __init__(self, filename, mmap=False, stats=False, dtype=None, x_range=None, subs=None):
+        self.stats = loadStats() if stats else None
+        self._dtype = _check_dtype(dtype)
+        self.mmap = mmap
+        self._mmap = None
+        self._buf = None
+        self._y_matrix = None
+        # range of points loaded, None for all
+        self._points = None
+        # first subfile with the same x-data as each -xy subfile, and whether
+        # they all have the same, None until known
+        self._x_from = None
+        self._common_x = None
         with open(filename, "rb") as fin:
-            content = fin.read()
-            # print "Read raw data"
+            if mmap:
+                # map the file, the mapping stays valid after closing fin
+                content = mmap_.mmap(fin.fileno(), 0, access=mmap_.ACCESS_READ)
+                self._mmap = content
+            else:
+                # load entire into memory temporarly
+                content = fin.read()
+
+        # subfiles are handed views of the content rather than copies
+        buf = memoryview(content)
 
         self.length = len(content)
-        # extract first two bytes to determine file type version
-        self.ftflg, self.fversn = struct.unpack('<cc'.encode('utf8'), content[:2])
+        self._lap('read', 0 if mmap else self.length)
+        self._read_header(content)
+        # memory mapped files only read the header so far
+        head_siz = self.old_head_siz if self.fversn == b'\x4d' else self.head_siz
+        self._lap('header', min(self.length, head_siz) if mmap else 0)
+
         # --------------------------------------------
-        # NEW FORMAT (LSB)
+        # NEW FORMAT (LSB or MSB)
         # --------------------------------------------
-        if self.fversn == b'\x4b':
-            # format: new LSB 1st
-            # -------------
-            # unpack header
-            # -------------
-            # use little-endian format with standard sizes
-            # use naming scheme in SPC.H header file
-            self.ftflg, \
-                self.fversn, \
-                self.fexper, \
-                self.fexp, \
-                self.fnpts, \
-                self.ffirst, \
-                self.flast, \
-                self.fnsub, \
-                self.fxtype, \
-                self.fytype, \
-                self.fztype, \
-                self.fpost, \
-                self.fdate, \
-                self.fres, \
-                self.fsource, \
-                self.fpeakpt, \
-                self.fspare, \
-                self.fcmnt, \
-                self.fcatxt, \
-                self.flogoff, \
-                self.fmods, \
-                self.fprocs, \
-                self.flevel, \
-                self.fsampin, \
-                self.ffactor, \
-                self.fmethod, \
-                self.fzinc, \
-                self.fwplanes, \
-                self.fwinc, \
-                self.fwtype, \
-                self.freserv \
-                = struct.unpack(self.head_str.encode('utf8'), content[:self.head_siz])
-
-            # Flag bits
-            self.tsprec, \
-                self.tcgram, \
-                self.tmulti, \
-                self.trandm, \
-                self.tordrd, \
-                self.talabs, \
-                self.txyxys, \
-                self.txvals = flag_bits(self.ftflg)[::-1]
-
-            # fix data types if necessary
-            self.fnpts = int(self.fnpts)  # of points should be int
-            self.fexp = ord(self.fexp)
-
-            self.ffirst = float(self.ffirst)
-            self.flast = float(self.flast)
-
-            self.flogoff = int(self.flogoff)  # byte; should be int
-
-            self.fxtype = ord(self.fxtype)
-            self.fytype = ord(self.fytype)
-            self.fztype = ord(self.fztype)
-
-            self.fexper = ord(self.fexper)
-            self.fcmnt = str(self.fcmnt)
-
-            # Convert date time to appropriate format
-            d = self.fdate
-            self.year = d >> 20
-            self.month = (d >> 16) % (2**4)
-            self.day = (d >> 11) % (2**5)
-            self.hour = (d >> 6) % (2**5)
-            self.minute = d % (2**6)
-
-            # null terminated string, replace null characters with spaces
-            # split and join to remove multiple spaces
-            try:
-                self.cmnt = ' '.join((self.fcmnt.replace('\x00', ' ')).split())
-            except:
-                self.cmnt = self.fcmnt
-
-            # figure out type of file
-            if self.fnsub > 1:
-                self.dat_multi = True
-
-            if self.txyxys:
-                # x values are given
-                self.dat_fmt = '-xy'
-            elif self.txvals:
-                # only one subfile, which contains the x data
-                self.dat_fmt = 'x-y'
-            else:
-                # no x values are given, but they can be generated
-                self.dat_fmt = 'gx-y'
-
-            print('{}({})'.format(self.dat_fmt, self.fnsub))
+        if self.fversn in (b'\x4b', b'\x4c'):
+            # format: new LSB 1st, or MSB 1st with the same layout in
+            # big-endian byte order
+            logger.info('%s: %s(%i)', filename, self.dat_fmt, self.fnsub)
 
             sub_pos = self.head_siz
 
@@ -166,231 +159,815 @@ class File:
                     # if global x data is given
                     x_dat_pos = self.head_siz
                     x_dat_end = self.head_siz + (4 * self.fnpts)
-                    self.x = np.array(
-                        [struct.unpack_from(
-                            'f', content[x_dat_pos:x_dat_end], 4 * i)[0]
-                            for i in range(0, self.fnpts)])
+                    self.x = np.frombuffer(content, self._endian + 'f4', self.fnpts,
+                                           x_dat_pos).astype(_x_dtype(self._dtype, np.float32))
                     sub_pos = x_dat_end
                 else:
-                    # otherwise generate them
-                    self.x = np.linspace(self.ffirst, self.flast, num=self.fnpts)
+                    # otherwise evenly spaced, only created when used
+                    self.x = evenAxis(self.ffirst, self.flast, self.fnpts,
+                                      _x_dtype(self._dtype))
 
-            # make a list of subfiles
-            self.sub = []
+            # index of subfile positions
+            # y data is 2 bytes per point if 16 bit, otherwise 4 bytes
+            y_siz = 2 if self.tsprec else 4
 
             # if subfile directory is given
             if self.dat_fmt == '-xy' and self.fnpts > 0:
                 self.directory = True
-                # loop over entries in directory
-                for i in range(0, self.fnsub):
-                    ssfposn, ssfsize, ssftime = struct.unpack(
-                        '<iif'.encode('utf8'), content[self.fnpts + (i * 12):self.fnpts + ((i + 1) * 12)])
-                    # add sufile, load defaults for npts and exp
-                    self.sub.append(subFile(content[ssfposn:ssfposn + ssfsize], 0, 0, True, self.tsprec, self.tmulti))
+                # entries in directory, ssfposn, ssfsize, ssftime
+                sub_dir = np.frombuffer(content, self.dir_dtype.newbyteorder(self._endian),
+                                        self.fnsub, self.fnpts)
+                self.sub_index = np.empty(self.fnsub, self.index_dtype)
+                self.sub_index['offset'] = sub_dir['ssfposn']
+                self.sub_index['size'] = sub_dir['ssfsize']
+
+            elif self.txyxys:
+                # don't have directory, use points in each subheader to
+                # figure out the size of each subfile
+                self.sub_index = np.empty(self.fnsub, self.index_dtype)
+                for i in range(self.fnsub):
+                    pts = struct.unpack_from((self._endian + 'i').encode('utf8'), buf,
+                                             sub_pos + 16)[0]
+                    # x and y data, and 32 for subheader
+                    dat_siz = (4 + y_siz) * pts + self.subhead_siz
+                    self.sub_index[i] = (sub_pos, dat_siz)
+                    sub_pos += dat_siz
+
+            else:
+                # use global points, all subfiles are the same size
+                dat_siz = y_siz * self.fnpts + self.subhead_siz
+                self.sub_index = np.empty(self.fnsub, self.index_dtype)
+                self.sub_index['offset'] = sub_pos + dat_siz * np.arange(self.fnsub)
+                self.sub_index['size'] = dat_siz
 
+            self._select(x_range, subs)
+
+            if not self.txyxys:
+                self.common_x = True
+            elif not mmap:
+                # subfiles with the same x-data as the one before them share
+                # its array, found from the raw data without decoding. Memory
+                # mapped files only compare subfiles as they are read
+                self._x_from = self._x_runs(buf)
+                self.common_x = self.fnsub > 0 and not self._x_from.any()
+
+            if mmap:
+                # only read subfiles when they are accessed
+                self._buf = buf
+                self.sub = subList(self.fnsub, self._read_sub)
             else:
-                # don't have directory, for each subfile
+                # y-data of x-y and gx-y is decoded below, straight into the
+                # y matrix
+                self.sub = []
                 for i in range(self.fnsub):
-                    # figure out its size
-                    if self.txyxys:
-                        # use points in subfile
-                        subhead_lst = read_subheader(content[sub_pos:(sub_pos + 32)])
-                        pts = subhead_lst[6]
-                        # 4 bytes each for x and y, and 32 for subheader
-                        dat_siz = (8 * pts) + 32
-                    else:
-                        # use global points
-                        pts = self.fnpts
-                        dat_siz = (4 * pts) + 32
-
-                    sub_end = sub_pos + dat_siz
-                    # read into object, add to list
-                    self.sub.append(subFile(content[sub_pos:sub_end],
-                                            self.fnpts, self.fexp, self.txyxys, self.tsprec, self.tmulti))
-                    # update positions
-                    sub_pos = sub_end
+                    self.sub.append(self._read_sub(i, buf, decode=self.txyxys))
+                self._y_matrix = self._build_y_matrix()
+            if self.txyxys and not mmap and self.common_x:
+                self.x = self.sub[0].x
+            self._lap('subfiles')
 
             # if log data exists
             # flog offset to log data offset not zero (bytes)
             if self.flogoff:
-                log_head_end = self.flogoff + self.log_siz
-                self.logsizd, \
-                    self.logsizm, \
-                    self.logtxto, \
-                    self.logbins, \
-                    self.logdsks, \
-                    self.logspar \
-                    = struct.unpack(self.logstc_str.encode('utf8'),
-                                    content[self.flogoff:log_head_end])
+                self._read_log_head(content[self.flogoff:self.flogoff + self.log_siz])
                 log_pos = self.flogoff + self.logtxto
-
-                log_end_pos = log_pos + self.logsizd
-
-                # line endings: get rid of any '\r' and then split on '\n'
-                self.log_content = content[log_pos:log_end_pos].replace(b'\r', b'').split(b'\n')
-
-                # split log data into dictionary based on =
-                self.log_dict = dict()
-                self.log_other = []  # put the rest into a list
-                for x in self.log_content:
-                    if x.find(b'=') >= 0:
-                        # stop it from breaking if there is more than 1 =
-                        key, value = x.split(b'=')[:2]
-                        self.log_dict[key] = value
-                    else:
-                        self.log_other.append(x)
-
-            # spacing between data
-            self.spacing = (self.flast - self.ffirst) / (self.fnpts - 1)
-
-            # call functions
-            self.set_labels()
-            self.set_exp_type()
-
-        # --------------------------------------------
-        # NEW FORMAT (MSB)
-        # --------------------------------------------
-        elif self.fversn == b'\x4c':
-            # new MSB 1st
-            print("New MSB 1st, yet to be implemented")
-            pass  # To be implemented
+                log = buf[log_pos:log_pos + self.logsizd]
+                # the text is only parsed when the log is first used, memory
+                # mapped files don't even read it until then
+                self._read_log_text(log if mmap else log.tobytes())
+                self._lap('log', self.log_siz if mmap else 0)
 
         # --------------------------------------------
         # OLD FORMAT
         # --------------------------------------------
         elif self.fversn == b'\x4d':
             # old format
-            # oxtype -> fxtype
-            # oytype -> fytype
-            self.oftflgs, \
-                self.oversn, \
-                self.oexp, \
-                self.onpts, \
-                self.ofirst, \
-                self.olast, \
-                self.fxtype, \
-                self.fytype, \
-                self.oyear, \
-                self.omonth, \
-                self.oday, \
-                self.ohour, \
-                self.ominute, \
-                self.ores, \
-                self.opeakpt, \
-                self.onscans, \
-                self.ospare, \
-                self.ocmnt, \
-                self.ocatxt, \
-                self.osubh1 = struct.unpack(self.old_head_str.encode('utf8'),
-                                            content[:self.old_head_siz])
-
-            # Flag bits (assuming same)
-            self.tsprec, \
-                self.tcgram, \
-                self.tmulti, \
-                self.trandm, \
-                self.tordrd, \
-                self.talabs, \
-                self.txyxys, \
-                self.txvals = flag_bits(self.oftflgs)[::-1]
-
-            # fix data types
-            self.oexp = int(self.oexp)
-            self.onpts = int(self.onpts)  # can't have floating num of pts
-            self.ofirst = float(self.ofirst)
-            self.olast = float(self.olast)
-
-            # Date information
-            # !! to fix !!
-            # Year collected (0=no date/time) - MSB 4 bits are Z type
-
-            # extracted as characters, using ord
-            self.omonth = ord(self.omonth)
-            self.oday = ord(self.oday)
-            self.ohour = ord(self.ohour)
-            self.ominute = ord(self.ominute)
-
-            # number of scans (? subfiles sometimes ?)
-            self.onscans = int(self.onscans)
-
-            # null terminated strings
-            self.ores = self.ores.split(b'\x00')[0]
-            self.ocmnt = self.ocmnt.split(b'\x00')[0]
-
             # can it have separate x values ?
-            self.x = np.linspace(self.ofirst, self.olast, num=self.onpts)
-
-            # make a list of subfiles
-            self.sub = []
+            self.x = evenAxis(self.ofirst, self.olast, self.onpts, _x_dtype(self._dtype))
+            self.common_x = not self.txyxys
 
             # already have subheader from main header, retrace steps
             sub_pos = self.old_head_siz - self.subhead_siz
 
             # for each subfile
-            # in the old format we don't know how many subfiles to expect,
-            # just looping till we run out
-            i = 0
-            while True:
-                try:
-                    # read in subheader
-                    subhead_lst = read_subheader(content[sub_pos:sub_pos + self.subhead_siz])
-
-                    if subhead_lst[6] > 0:
-                        # default to subfile points, unless it is zero
-                        pts = subhead_lst[6]
-                    else:
-                        pts = self.onpts
-
-                    # figure out size of subheader
-                    dat_siz = (4 * pts)
-                    sub_end = sub_pos + self.subhead_siz + dat_siz
-
-                    # read into object, add to list
-                    # send it pts since we have already figured that out
-                    self.sub.append(subFileOld(
-                        content[sub_pos:sub_end], pts, self.oexp, self.txyxys))
-                    # update next subfile postion, and index
-                    sub_pos = sub_end
-
-                    i += 1
-                except:
-                    # zero indexed, set the total number of subfile
-                    self.fnsub = i + 1
+            index = []
+            for i in range(self.fnsub):
+                # read in subheader
+                subhead_lst = read_subheader(content[sub_pos:sub_pos + self.subhead_siz])
+
+                if subhead_lst[6] > 0:
+                    # default to subfile points, unless it is zero
+                    pts = subhead_lst[6]
+                else:
+                    pts = self.onpts
+
+                # figure out size of subheader
+                dat_siz = (4 * pts)
+                sub_end = sub_pos + self.subhead_siz + dat_siz
+                if sub_end > self.length:
+                    # truncated subfile, stop here
                     break
 
-            # assuming it can't have separate x values
-            self.dat_fmt = 'gx-y'
-            print('{}({})'.format(self.dat_fmt, self.fnsub))
+                index.append((sub_pos, sub_end - sub_pos))
+                # update next subfile postion
+                sub_pos = sub_end
 
-            self.fxtype = ord(self.fxtype)
-            self.fytype = ord(self.fytype)
-            # need to find from year apparently
-            self.fztype = 0
-            self.set_labels()
+            self.fnsub = len(index)
+            self.sub_index = np.array(index, self.index_dtype)
+            self._select(x_range, subs)
+            # make a list of subfiles
+            self.sub = [self._read_sub(i, buf) for i in range(self.fnsub)]
+
+            self._y_matrix = self._build_y_matrix()
+            self._lap('subfiles', max(sub_pos - self.old_head_siz, 0) if mmap else 0)
+            logger.info('%s: %s(%i)', filename, self.dat_fmt, self.fnsub)
 
         # --------------------------------------------
         # SHIMADZU
         # --------------------------------------------
         elif self.fversn == b'\xcf':
-            print("Highly experimental format, may not work ")
-            raw_data = content[10240:]  # data starts here (maybe every time)
-            # spacing between y and x data is atleast 0 bytes
-            s_32 = chr(int('0', 2)) * 32
-            s_8 = chr(int('0', 2)) * 8  # zero double
-            dat_len = raw_data.find(s_32)
-            for i in range(dat_len, len(raw_data), 8):
-                # find first non zero double
-                if raw_data[i:i + 8] != s_8:
-                    break
-            dat_siz = int(dat_len / 8)
-            self.y = struct.unpack(('<' + dat_siz * 'd').encode('utf8'), raw_data[:dat_len])
-            self.x = struct.unpack(('<' + dat_siz * 'd').encode('utf8'), raw_data[i:i + dat_len])
+            logger.warning('%s: Highly experimental format, may not work', filename)
+            self._read_shimadzu(buf)
+            if x_range is not None or subs is not None:
+                # already decoded, only keep the parts asked for
+                subheads = self._subheaders()
+                self._select(x_range, subs)
+                y = self._y_matrix[self.sub_numbers]
+                if self._points is not None:
+                    y = y[:, self._points[0]:self._points[1]]
+                self._y_matrix = y.copy()
+                subheads = subheads[self.sub_numbers]
+                subheads['subnpts'] = self.fnpts
+                self.sub = [subFile._from_decoded(h, None, row)
+                            for h, row in zip(subheads, self._y_matrix)]
+            self._lap('subfiles')
 
         else:
-            print("File type %s not supported yet. Please add issue. "
-                  % hex(ord(self.fversn)))
+            logger.warning('%s: File type %s not supported yet. Please add issue.',
+                           filename, hex(ord(self.fversn)))
             self.content = content
 
+        if self.stats is not None:
+            self.stats.nsub = len(getattr(self, 'sub', ()))
+            self.stats.decoded_bytes = self._decoded_bytes()
+
+    # ------------------------------------------------------------------------
+    # Load stats
+    # ------------------------------------------------------------------------
+
+    def _lap(self, phase, nbytes=0):
+        """ Record the time spent in a load phase and the bytes it read """
+        if self.stats is not None:
+            self.stats.lap(phase)
+            self.stats.bytes_read += nbytes
+
+    def _decoded_bytes(self):
+        """ Memory owned by the decoded x and y arrays, views into the file
+        or into y_matrix are not counted """
+        arrays = [vars(self).get('x'), self._y_matrix]
+        subs = getattr(self, 'sub', [])
+        if isinstance(subs, subList):
+            # only the subfiles that have been read
+            subs = [s for s in subs._subs if s is not None]
+        for s in subs:
+            # decoded data of subFile or subFileOld
+            arrays.extend(vars(s).get(k) for k in ('_x', '_y', 'x', 'y'))
+        owners = {}
+        for a in arrays:
+            if not isinstance(a, np.ndarray):
+                continue
+            # follow views back to the array owning the memory, arrays over
+            # the file content end at a buffer instead
+            while isinstance(a.base, np.ndarray):
+                a = a.base
+            if a.base is None:
+                owners[id(a)] = a.nbytes
+        return sum(owners.values())
+
+    # ------------------------------------------------------------------------
+    # Header
+    # ------------------------------------------------------------------------
+
+    @classmethod
+    def _from_header(cls, content, length):
+        """ Create a File with only the header parsed
+
+        Arguments
+        ---------
+        content: bytes
+            start of the file, at least the main header
+        length: int
+            size of the file in bytes
+        """
+        self = cls.__new__(cls)
+        self.length = length
+        self._read_header(content)
+        return self
+
+    def _read_header(self, content):
+        """ Parse the main header from the start of content, the remainder of
+        the file is not needed """
+        # extract first two bytes to determine file type version
+        self.ftflg, self.fversn = struct.unpack('<cc'.encode('utf8'), content[:2])
+        # byte order of everything after the first two bytes
+        self._endian = '>' if self.fversn == b'\x4c' else '<'
+        if self.fversn in (b'\x4b', b'\x4c'):
+            self._read_new_header(content)
+        elif self.fversn == b'\x4d':
+            self._read_old_header(content)
+
+    def _read_new_header(self, content):
+        """ Parse the header of the new format (LSB or MSB) """
+        # -------------
+        # unpack header
+        # -------------
+        # use the byte order of the file with standard sizes
+        # use naming scheme in SPC.H header file
+        self.ftflg, \
+            self.fversn, \
+            self.fexper, \
+            self.fexp, \
+            self.fnpts, \
+            self.ffirst, \
+            self.flast, \
+            self.fnsub, \
+            self.fxtype, \
+            self.fytype, \
+            self.fztype, \
+            self.fpost, \
+            self.fdate, \
+            self.fres, \
+            self.fsource, \
+            self.fpeakpt, \
+            self.fspare, \
+            self.fcmnt, \
+            self.fcatxt, \
+            self.flogoff, \
+            self.fmods, \
+            self.fprocs, \
+            self.flevel, \
+            self.fsampin, \
+            self.ffactor, \
+            self.fmethod, \
+            self.fzinc, \
+            self.fwplanes, \
+            self.fwinc, \
+            self.fwtype, \
+            self.freserv \
+            = struct.unpack((self._endian + self.head_str[1:]).encode('utf8'),
+                            content[:self.head_siz])
+
+        # Flag bits
+        self.tsprec, \
+            self.tcgram, \
+            self.tmulti, \
+            self.trandm, \
+            self.tordrd, \
+            self.talabs, \
+            self.txyxys, \
+            self.txvals = flag_bits(self.ftflg)[::-1]
+
+        # fix data types if necessary
+        self.fnpts = int(self.fnpts)  # of points should be int
+        self.fexp = ord(self.fexp)
+
+        self.ffirst = float(self.ffirst)
+        self.flast = float(self.flast)
+
+        self.flogoff = int(self.flogoff)  # byte; should be int
+
+        self.fxtype = ord(self.fxtype)
+        self.fytype = ord(self.fytype)
+        self.fztype = ord(self.fztype)
+
+        self.fexper = ord(self.fexper)
+        self.fcmnt = self.fcmnt.decode('latin-1')
+
+        # Convert date time to appropriate format
+        d = self.fdate
+        self.year = d >> 20
+        self.month = (d >> 16) % (2**4)
+        self.day = (d >> 11) % (2**5)
+        self.hour = (d >> 6) % (2**5)
+        self.minute = d % (2**6)
+
+        # null terminated string, replace null characters with spaces
+        # split and join to remove multiple spaces
+        try:
+            self.cmnt = ' '.join((self.fcmnt.replace('\x00', ' ')).split())
+        except:
+            self.cmnt = self.fcmnt
+
+        # figure out type of file
+        if self.fnsub > 1:
+            self.dat_multi = True
+
+        if self.txyxys:
+            # x values are given
+            self.dat_fmt = '-xy'
+        elif self.txvals:
+            # only one subfile, which contains the x data
+            self.dat_fmt = 'x-y'
+        else:
+            # no x values are given, but they can be generated
+            self.dat_fmt = 'gx-y'
+
+        # spacing between data
+        self.spacing = (self.flast - self.ffirst) / (self.fnpts - 1)
+
+        # call functions
+        self.set_labels()
+        self.set_exp_type()
+
+    def _read_old_header(self, content):
+        """ Parse the header of the old format """
+        # oxtype -> fxtype
+        # oytype -> fytype
+        self.oftflgs, \
+            self.oversn, \
+            self.oexp, \
+            self.onpts, \
+            self.ofirst, \
+            self.olast, \
+            self.fxtype, \
+            self.fytype, \
+            self.oyear, \
+            self.omonth, \
+            self.oday, \
+            self.ohour, \
+            self.ominute, \
+            self.ores, \
+            self.opeakpt, \
+            self.onscans, \
+            self.ospare, \
+            self.ocmnt, \
+            self.ocatxt, \
+            self.osubh1 = struct.unpack(self.old_head_str.encode('utf8'),
+                                        content[:self.old_head_siz])
+
+        # Flag bits (assuming same)
+        self.tsprec, \
+            self.tcgram, \
+            self.tmulti, \
+            self.trandm, \
+            self.tordrd, \
+            self.talabs, \
+            self.txyxys, \
+            self.txvals = flag_bits(self.oftflgs)[::-1]
+
+        # fix data types
+        self.oexp = int(self.oexp)
+        self.onpts = int(self.onpts)  # can't have floating num of pts
+        self.ofirst = float(self.ofirst)
+        self.olast = float(self.olast)
+
+        # Date information
+        # !! to fix !!
+        # Year collected (0=no date/time) - MSB 4 bits are Z type
+
+        # extracted as characters, using ord
+        self.omonth = ord(self.omonth)
+        self.oday = ord(self.oday)
+        self.ohour = ord(self.ohour)
+        self.ominute = ord(self.ominute)
+
+        # number of scans (? subfiles sometimes ?)
+        self.onscans = int(self.onscans)
+
+        # null terminated strings
+        self.ores = self.ores.split(b'\x00')[0]
+        self.ocmnt = self.ocmnt.split(b'\x00')[0]
+
+        self.fxtype = ord(self.fxtype)
+        self.fytype = ord(self.fytype)
+        # need to find from year apparently
+        self.fztype = 0
+        self.set_labels()
+
+        # in the old format the number of subfiles is not stored, work it
+        # out from the file length, each subfile has a subheader and
+        # 4 bytes per point
+        sub_pos = self.old_head_siz - self.subhead_siz
+        sub_siz = self.subhead_siz + (4 * self.onpts)
+        self.fnsub = (self.length - sub_pos) // sub_siz
+
+        # assuming it can't have separate x values
+        self.dat_fmt = 'gx-y'
+
+    # ------------------------------------------------------------------------
+    # Shimadzu
+    # ------------------------------------------------------------------------
+
+    def _read_shimadzu(self, buf):
+        """ Locate the x and y data of a Shimadzu file, there is no
+        specification so this relies on the layout of known files: a block of
+        y doubles, followed (after at least 32 zero bytes) by a block of as
+        many x doubles """
+        # data starts here (maybe every time)
+        start = self.shimadzu_pos
+        nval = max(len(buf) - start, 0) // 8
+        raw = np.frombuffer(buf, '<u8', nval, start)
+
+        # y data ends at the first run of (at least) 4 zero doubles
+        zero = raw == 0
+        run = zero[:-3] & zero[1:-2] & zero[2:-1] & zero[3:]
+        ends = np.flatnonzero(run)
+        if not len(ends):
+            raise ValueError("could not find the end of the y data")
+        npts = int(ends[0])
+
+        # x data starts at the first non zero double after that
+        x_start = np.flatnonzero(~zero[npts:])
+        if not len(x_start):
+            raise ValueError("could not find the x data")
+        x_pos = npts + int(x_start[0])
+
+        # zero y values at the end look like the gap, the length of the x
+        # data (up to the next run of zeros) gives the real number of points
+        x_ends = ends[ends > x_pos]
+        x_len = int(x_ends[0]) - x_pos if len(x_ends) else nval - x_pos
+        if npts < x_len <= x_pos:
+            npts = x_len
+
+        if x_pos + npts > nval:
+            raise ValueError("could not find the x data")
+        y = raw[:npts].view('<f8').astype(np.float64)
+        self.x = raw[x_pos:x_pos + npts].view('<f8').astype(np.float64)
+        if npts > 1 and not (np.all(np.diff(self.x) > 0) or np.all(np.diff(self.x) < 0)):
+            logger.warning('Shimadzu x data is not monotonic, it may have been misread')
+
+        # present it as a single x-y subfile
+        self.fnpts = npts
+        self.fnsub = 1
+        self.fexp = 128
+        self.ffirst = float(self.x[0]) if npts else 0.0
+        self.flast = float(self.x[-1]) if npts else 0.0
+        self.tsprec = self.tcgram = self.tmulti = self.trandm = False
+        self.tordrd = self.talabs = self.txyxys = False
+        self.txvals = True
+        self.dat_fmt = 'x-y'
+        self.common_x = True
+        self.fxtype = self.fytype = self.fztype = 0
+        self.set_labels()
+
+        subhead = np.zeros(1, self.subhead_dtype)
+        subhead['subexp'] = 128
+        subhead['subnpts'] = npts
+        self._y_matrix = y[None, :]
+        self.sub = [subFile._from_decoded(subhead[0], None, self._y_matrix[0])]
+        self.sub_index = np.array([(start, 8 * npts)], self.index_dtype)
+
+    # ------------------------------------------------------------------------
+    # Log block
+    # ------------------------------------------------------------------------
+
+    def _read_log_head(self, content):
+        """ Parse the 64 byte log block header """
+        self.logsizd, \
+            self.logsizm, \
+            self.logtxto, \
+            self.logbins, \
+            self.logdsks, \
+            self.logspar \
+            = struct.unpack((self._endian + self.logstc_str[1:]).encode('utf8'),
+                            content[:self.log_siz])
+
+    def _read_log_text(self, content):
+        """ Keep the raw log text, it is parsed on first access of log_dict,
+        log_other, log_content or log_values """
+        self._log_raw = content
+        self._log = None
+
+    def _parse_log(self):
+        """ Parse the log text into log_content, log_dict and log_other,
+        once """
+        if self._log is None:
+            if getattr(self, '_log_raw', None) is None:
+                raise AttributeError("file has no log block")
+            if getattr(self, 'mmap', False) and getattr(self, 'stats', None) is not None:
+                self.stats.bytes_read += len(self._log_raw)
+            text = bytes(self._log_raw).decode('latin-1')
+
+            # line endings: get rid of any '\r' and then split on '\n'
+            log_content = text.replace('\r', '').split('\n')
+
+            # split log data into dictionary based on =
+            log_dict = dict()
+            log_other = []  # put the rest into a list
+            for x in log_content:
+                if x.find('=') >= 0:
+                    # stop it from breaking if there is more than 1 =
+                    key, value = x.split('=')[:2]
+                    log_dict[key] = value
+                else:
+                    log_other.append(x)
+            self._log = (log_content, log_dict, log_other)
+            self._log_raw = b''
+        return self._log
+
+    @property
+    def log_content(self):
+        """ Lines of the log text """
+        return self._parse_log()[0]
+
+    @property
+    def log_dict(self):
+        """ key=value lines of the log as a dictionary of strings """
+        return self._parse_log()[1]
+
+    @property
+    def log_other(self):
+        """ Lines of the log that are not key=value """
+        return self._parse_log()[2]
+
+    @property
+    def log_values(self):
+        """ log_dict with numeric values converted to int or float, the
+        conversion is only done once
+
+        Example
+        -------
+        >>> f.log_values['Integration Time'] * f.fnsub
+        """
+        if getattr(self, '_log_values', None) is None:
+            self._log_values = dict((k, _log_value(v)) for k, v in self.log_dict.items())
+        return self._log_values
+
+    # ------------------------------------------------------------------------
+    # Memory mapped files
+    # ------------------------------------------------------------------------
+
+    def close(self):
+        """ Release the memory map if the file was opened with mmap=True.
+
+        Arrays that are still views into the file keep the mapping alive, so
+        the map is only closed once they are gone. Reading a subfile that was
+        not read before raises ValueError after this.
+        """
+        if self._mmap is not None:
+            # subfiles that have not been read yet can't be read after this
+            self._buf = None
+            if isinstance(getattr(self, '_log_raw', None), memoryview):
+                # keep the log readable, without holding on to the map
+                self._log_raw = self._log_raw.tobytes()
+            try:
+                self._mmap.close()
+            except BufferError:
+                # views are still exported, let garbage collection close it
+                pass
+            self._mmap = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # ------------------------------------------------------------------------
+    # y-data of all subfiles
+    # ------------------------------------------------------------------------
+
+    @property
+    def y_matrix(self):
+        """ y-data of all subfiles as a single (fnsub, fnpts) array, with
+        sub[i].y being a view of row i. None if the subfiles have different x
+        data ('-xy' format without common_x).
+
+        Example
+        -------
+        >>> f.y_matrix.mean(axis=0)  # average spectrum
+        """
+        if self._y_matrix is None and getattr(self, 'sub', None):
+            # deferred until first use for memory mapped files
+            if self.mmap and self._mmap is None and self.common_x:
+                # the memory map was released by close(), -xy files with
+                # different x-data still have no y matrix
+                raise ValueError("I/O operation on closed file")
+            offset = self.sub_index['offset']
+            step = np.diff(offset)
+            if self.mmap and self.dat_fmt != '-xy' and self._all_float() and \
+                    np.all(step == step[:1]) and \
+                    (not isinstance(self._dtype, np.dtype) or self._dtype == np.float32):
+                # floating y-data can be used in place, the subfiles are
+                # a fixed number of bytes apart
+                start = self._points[0] if self._points else 0
+                self._y_matrix = np.ndarray(
+                    (self.fnsub, self.fnpts), self._endian + 'f4', self._mmap,
+                    offset=offset[0] + self.subhead_siz + 4 * start,
+                    strides=(int(step[0]) if len(step) else 0, 4))
+            else:
+                self._y_matrix = self._build_y_matrix()
+        return self._y_matrix
+
+    @property
+    def common_x(self):
+        """ True if all subfiles have the same x-data, for memory mapped -xy
+        files only checked (reading the x-data of every subfile) when first
+        used """
+        if self._common_x is None:
+            if self._buf is None:
+                raise ValueError("I/O operation on closed file")
+            self._common_x = self.fnsub > 0 and not self._x_runs(self._buf).any()
+        return self._common_x
+
+    @common_x.setter
+    def common_x(self, value):
+        self._common_x = value
+
+    def __getattr__(self, name):
+        # x-data of memory mapped -xy files, only looked for when used
+        if name == 'x' and vars(self).get('txyxys') and vars(self).get('_buf') is not None \
+                and self.common_x:
+            self.x = self.sub[0].x
+            return self.x
+        raise AttributeError("'%s' object has no attribute '%s'" % (type(self).__name__, name))
+
+    def _all_float(self):
+        """ Check if all subfiles have floating y-data, using the index """
+        if self._buf is None:
+            raise ValueError("I/O operation on closed file")
+        if not self.tmulti:
+            return self.fexp == 128
+        # subexp is the second byte of each subheader
+        subexp = np.frombuffer(self._buf, np.uint8)[self.sub_index['offset'] + 1]
+        return bool(np.all(subexp == 128))
+
+    def _build_y_matrix(self):
+        """ Decode (or copy) the y-data of each subfile into a row of a new
+        array and point the subfiles at their rows """
+        if not self.sub or not self.common_x or len(set(s._pts for s in self.sub)) != 1:
+            return None
+
+        dtype = reduce(np.promote_types, set(s.y_dtype for s in self.sub))
+        y_matrix = np.empty((len(self.sub), self.sub[0]._pts), dtype)
+        for s, row in zip(self.sub, y_matrix):
+            if isinstance(s, subFile) and s._y is None:
+                s._decode(row)
+            else:
+                row[...] = s.y
+                s.y = row
+        return y_matrix
+
+    def resample(self, x=None, n=None, left=np.nan, right=np.nan):
+        """ y-data of all subfiles linearly interpolated onto the same x
+        values, in one operation for all subfiles, e.g. to use the matrix
+        methods on -xy files
+
+        Arguments
+        ---------
+        x: array (default=None)
+            x values to interpolate at. By default n evenly spaced values from
+            the lowest to the highest x value of all subfiles, or for files
+            with common_x the x-data and y_matrix as they are
+        n: int (default=None)
+            number of default x values, the most points in a subfile if None
+        left, right: float (default=nan)
+            value for x values before or after the x-data of a subfile
+
+        Returns
+        -------
+        (x, y): tuple
+            the x values (an evenAxis for the default ones) and the
+            (fnsub, len(x)) float64 array of y values
+
+        Example
+        -------
+        >>> x, y = f.resample(n=2000)
+        >>> plt.plot(x, y.mean(axis=0))
+        """
+        if x is None and n is None and self.common_x and self.y_matrix is not None:
+            return self.x, self.y_matrix
+
+        ys = [s.y for s in self.sub]
+        if self.txyxys:
+            # subfiles with the same x-data share the array, and are
+            # interpolated together
+            xs = [s.x for s in self.sub]
+        else:
+            xs = [np.asarray(self.x)] * len(ys)
+        if x is None:
+            ranges = [(np.min(i), np.max(i)) for i in dict((id(i), i) for i in xs).values()
+                      if len(i)]
+            if not ranges:
+                raise ValueError("no x-data to choose x values from")
+            x = evenAxis(min(r[0] for r in ranges), max(r[1] for r in ranges),
+                         n or max(len(y) for y in ys))
+        return x, interp_rows(x, xs, ys, left, right)
+
+    # ------------------------------------------------------------------------
+    # Subfiles
+    # ------------------------------------------------------------------------
+
+    def _read_sub(self, i, buf=None, decode=True):
+        """ Create the subFile object for subfile i using the index """
+        if buf is None:
+            buf = self._buf
+            if buf is None:
+                # the memory map was released by close()
+                raise ValueError("I/O operation on closed file")
+        offset, size = self.sub_index[i]
+        data = buf[offset:offset + size]
+        if self._points is not None:
+            # only the y-data of the points in x_range
+            y_siz = 2 if self.tsprec else 4
+            start, stop = self._points
+            data = data[:self.subhead_siz].tobytes() + \
+                data[self.subhead_siz + y_siz * start:self.subhead_siz + y_siz * stop].tobytes()
+
+        if self.fversn == b'\x4d':
+            if self._points is not None:
+                pts = self._points[1] - self._points[0]
+            else:
+                # default to subfile points, unless it is zero
+                pts = read_subheader(data[:self.subhead_siz])[6]
+                if pts <= 0:
+                    pts = self.onpts
+            return subFileOld(data, pts, self.oexp, self.txyxys, self._dtype)
+
+        if self.mmap and self.stats is not None:
+            self.stats.bytes_read += len(data)
+        if getattr(self, 'directory', False):
+            # load defaults for npts and exp
+            fnpts, fexp = 0, 0
+        else:
+            fnpts, fexp = self.fnpts, self.fexp
+        x = None
+        if self.txyxys and self._x_from is not None:
+            if self._x_from[i] != i:
+                # same x-data as an earlier subfile, share its array
+                x = self.sub[self._x_from[i]].x
+        elif self.txyxys:
+            # memory mapped, share with a neighbour that has been read
+            for j in (i - 1, i + 1):
+                if 0 <= j < self.fnsub and self.sub._subs[j] is not None and \
+                        self._same_x(buf, i, j):
+                    x = self.sub[j].x
+                    break
+        if x is not None:
+            x.flags.writeable = False
+        return subFile(data, fnpts, fexp, self.txyxys,
+                       self.tsprec, self.tmulti, lazy=self.mmap, decode=decode,
+                       endian=self._endian, dtype=self._dtype, x=x)
+
+    def _select(self, x_range, subs):
+        """ Only keep the subfiles subs in the index, and the points of the
+        global x-data within x_range """
+        if subs is not None:
+            self.sub_numbers = np.atleast_1d(np.arange(self.fnsub)[subs])
+            self.sub_index = self.sub_index[self.sub_numbers]
+            self.fnsub = len(self.sub_index)
+        else:
+            self.sub_numbers = np.arange(self.fnsub)
+
+        if x_range is None:
+            return
+        if self.txyxys:
+            raise ValueError("x_range needs global x-data, the subfiles of -xy files have "
+                             "their own")
+        start, stop = _x_span(self.x, *x_range)
+        self._points = (start, stop)
+        self.x = self.x[start:stop]
+        if isinstance(self.x, np.ndarray):
+            # don't keep the rest of the x-data
+            self.x = self.x.copy()
+        # the header describes the points loaded
+        first, last = (float(self.x[0]), float(self.x[-1])) if len(self.x) else (0.0, 0.0)
+        if self.fversn == b'\x4d':
+            self.onpts, self.ofirst, self.olast = stop - start, first, last
+        else:
+            self.fnpts, self.ffirst, self.flast = stop - start, first, last
+
+    def _same_x(self, buf, i, j):
+        """ Check if -xy subfiles i and j have the same number of points,
+        exponent and raw x-data, without decoding them """
+        heads = [buf[o:o + 20].tobytes() for o in self.sub_index['offset'][[i, j]].tolist()]
+        npts = [struct.unpack_from((self._endian + 'i').encode('utf8'), h, 16)[0] for h in heads]
+        if npts[0] != npts[1] or (self.tmulti and heads[0][1] != heads[1][1]):
+            return False
+        x_pos = self.sub_index['offset'][[i, j]] + self.subhead_siz
+        n = 4 * npts[0]
+        return buf[x_pos[0]:x_pos[0] + n] == buf[x_pos[1]:x_pos[1] + n]
+
+    def _x_runs(self, buf):
+        """ For each subfile of a -xy file, the index of the first subfile of
+        the run of subfiles before it with the same x-data. Compares the
+        number of points, exponent and raw x-data of neighbouring subfiles,
+        without decoding them """
+        offset = self.sub_index['offset']
+        # start of each subheader: flags, exponent, ..., npts at 16
+        head = np.frombuffer(buf, np.uint8)[offset[:, None] + np.arange(20)]
+        npts = head[:, 16:].copy().view(self._endian + 'i4')[:, 0]
+        # the global exponent is used unless tmulti is set
+        exp = head[:, 1] if self.tmulti else np.zeros(len(offset), np.uint8)
+        x_pos = (offset + self.subhead_siz).tolist()
+
+        same = np.zeros(len(offset), bool)
+        for i in np.flatnonzero((npts[1:] == npts[:-1]) & (exp[1:] == exp[:-1])).tolist():
+            n = 4 * int(npts[i])
+            same[i + 1] = buf[x_pos[i]:x_pos[i] + n] == buf[x_pos[i + 1]:x_pos[i + 1] + n]
+        # index of the last subfile that starts a run
+        return np.maximum.accumulate(np.where(same, 0, np.arange(len(offset))))
+
     # ------------------------------------------------------------------------
     # Process other data
     # ------------------------------------------------------------------------
@@ -531,7 +1108,7 @@ class File:
     # ------------------------------------------------------------------------
     # output
     # ------------------------------------------------------------------------
-    def data_txt(self, delimiter='\t', newline='\n'):
+    def data_txt(self, delimiter='\t', newline='\n', fmt=None):
         """ Returns x,y column data as a string variable, can be printed to
         standard output or fed to text file.
 
@@ -541,68 +1118,39 @@ class File:
             delimiter character for column separation
         newline: chr (default='\n')
             newline character, may want to use '\r\n' for Windows based output
+        fmt: str (default=None)
+            printf style format for all values, e.g. '%.6f'. By default values
+            are written out in full
 
         Example
         -------
         >>> f.data_txt(newline='\r\n')
 
         """
-
-        dat = ''
-        if self.fnsub == 1:
-            if self.dat_fmt.endswith('-xy'):
-                x = self.sub[0].x
-            else:
-                x = self.x
-            y = self.sub[0].y
-
-            for x1, y1 in zip(x, y):
-                dat += '{}{}{}{}'.format(x1, delimiter, y1, newline)
-        else:
-            if not self.dat_fmt.endswith('-xy'):
-                # does not have separate x data
-                for i in range(len(self.x)):
-                    dat += '{}'.format(self.x[i])
-                    for s in self.sub:
-                        dat += '{}{}'.format(delimiter, s.y[i])
-                    dat += newline
-            else:
-                # txyxy format, return one long xy file with subfiles
-                # separated by blank lines
-                for i in self.sub:
-                    for x1, y1 in zip(i.x, i.y):
-                        dat += '{}{}{}{}'.format(x1, delimiter, y1, newline)
-                    dat += newline
-        return dat
+        return ''.join(self._txt_chunks(delimiter, newline, fmt))
 
     # Writes out data to a stream (significantly faster than appending to a string)
-    def stream_data_txt(self, stream, delimiter='\t', newline='\n'):
-        if self.fnsub == 1:
-            if self.dat_fmt.endswith('-xy'):
-                x = self.sub[0].x
-            else:
-                x = self.x
-            y = self.sub[0].y
+    def stream_data_txt(self, stream, delimiter='\t', newline='\n', fmt=None):
+        for chunk in self._txt_chunks(delimiter, newline, fmt):
+            stream.write(chunk)
 
-            for x1, y1 in zip(x, y):
-                stream.write('{}{}{}{}'.format(x1, delimiter, y1, newline))
+    def _txt_chunks(self, delimiter, newline, fmt):
+        """ Generate the text output of data_txt in large chunks """
+        if self.dat_fmt.endswith('-xy'):
+            # txyxy format, return one long xy file with subfiles
+            # separated by blank lines
+            for s in self.sub:
+                for chunk in text_chunks([s.x, s.y], delimiter, newline, fmt):
+                    yield chunk
+                if self.fnsub != 1:
+                    yield newline
         else:
-            if not self.dat_fmt.endswith('-xy'):
-                # does not have separate x data
-                for i in range(len(self.x)):
-                    stream.write('{}'.format(self.x[i]))
-                    for s in self.sub:
-                        stream.write('{}{}'.format(delimiter, s.y[i]))
-                    stream.write(newline)
-            else:
-                # txyxy format, return one long xy file with subfiles
-                # separated by blank lines
-                for i in self.sub:
-                    for x1, y1 in zip(i.x, i.y):
-                        stream.write('{}{}{}{}'.format(x1, delimiter, y1, newline))
-                    stream.write(newline)
-
-    def write_file(self, path, delimiter='\t', newline='\n'):
+            # does not have separate x data, one column per subfile
+            columns = [self.x] + [s.y for s in self.sub]
+            for chunk in text_chunks(columns, delimiter, newline, fmt):
+                yield chunk
+
+    def write_file(self, path, delimiter='\t', newline='\n', fmt=None):
         """ Output x,y data to text file tab seperated
 
         Arguments
@@ -613,6 +1161,8 @@ class File:
             delimiter character for column separation
         newline: chr (default='\n')
             newline character, may want to use '\r\n' for Windows based output
+        fmt: str (default=None)
+            printf style format for all values, e.g. '%.6f'
 
         Example
         -------
@@ -620,15 +1170,154 @@ class File:
 
         """
         with open(path, 'w') as f:
-            self.stream_data_txt(f, delimiter, newline)
+            self.stream_data_txt(f, delimiter, newline, fmt)
+
+    def write_npz(self, path, compressed=False):
+        """ Output data and metadata to a NumPy .npz archive
+
+        The archive holds x, y, the subheaders of each subfile as a
+        structured array and the header metadata as a JSON string. For x-y and
+        gx-y files y is the (fnsub, fnpts) y_matrix, for -xy files x and y are
+        the data of all subfiles joined end to end, with the number of points
+        in each subfile in npts.
+
+        Arguments
+        ---------
+        path: str
+            full path to output file including extension
+        compressed: bool (default=False)
+            compress the arrays in the archive
+
+        Example
+        -------
+        >>> f.write_npz('/Users/home/output.npz')
+        >>> dat = np.load('/Users/home/output.npz')
+        >>> dat['x'], dat['y'], json.loads(str(dat['header']))
+
+        """
+        arrays = self._export_arrays()
+        arrays['header'] = np.array(self._header_json())
+        if compressed:
+            np.savez_compressed(path, **arrays)
+        else:
+            np.savez(path, **arrays)
+
+    def write_npy(self, path):
+        """ Output data and metadata to a directory of .npy files, which can be
+        memory mapped with np.load(..., mmap_mode='r')
+
+        The directory holds x.npy, y.npy, subheaders.npy (and npts.npy for -xy
+        files) laid out as in write_npz, and the header metadata in
+        header.json.
+
+        Arguments
+        ---------
+        path: str
+            full path to output directory, created if needed
+
+        Example
+        -------
+        >>> f.write_npy('/Users/home/output')
+        >>> y = np.load('/Users/home/output/y.npy', mmap_mode='r')
+
+        """
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        for name, arr in self._export_arrays().items():
+            np.save(os.path.join(path, name + '.npy'), arr)
+        with open(os.path.join(path, 'header.json'), 'w') as f:
+            f.write(self._header_json())
+
+    def _export_arrays(self):
+        """ Arrays written out by write_npz and write_npy """
+        subheaders = self._subheaders()
+        if self.dat_fmt.endswith('-xy'):
+            # ragged, join all the subfiles together
+            return {'x': np.concatenate([s.x for s in self.sub]),
+                    'y': np.concatenate([s.y for s in self.sub]),
+                    'npts': np.array([len(s.y) for s in self.sub]),
+                    'subheaders': subheaders}
+        return {'x': np.asarray(self.x),
+                'y': self.y_matrix,
+                'subheaders': subheaders}
+
+    def _subheaders(self):
+        """ Subheader fields of all subfiles as a structured array """
+        return np.array(
+            [(s.subflgs, s.subexp, s.subindx, s.subtime, s.subnext, s.subnois,
+              s.subnpts, s.subscan, s.subwlevel, s.subresv) for s in self.sub],
+            self.subhead_dtype)
+
+    def save(self, path, dtype='float'):
+        """ Write the data, header and log out to a new format (LSB) .SPC file,
+        see spc.write
+
+        Arguments
+        ---------
+        path: str
+            full path to output file including extension
+        dtype: str (default='float')
+            'float' to store y as 32 bit floats, 'int' as scaled 32 bit
+            integers
+
+        Example
+        -------
+        >>> f.y_matrix -= f.y_matrix.min(axis=1)[:, None]
+        >>> f.save('/Users/home/baseline.spc')
+
+        """
+        from .writer import write, header_defaults, flag_defaults
+
+        header = dict((k, getattr(self, k)) for k, v in header_defaults + flag_defaults
+                      if hasattr(self, k))
+        if self.dat_fmt.endswith('-xy'):
+            x = [s.x for s in self.sub]
+            y = [s.y for s in self.sub]
+        else:
+            x = self.x
+            y = self.y_matrix
+        if self._dtype == 'raw':
+            # write the values, not the stored integers
+            scale = [s.y_scale for s in self.sub]
+            if isinstance(y, list):
+                y = [sy * k for sy, k in zip(y, scale)]
+            else:
+                y = y * np.array(scale)[:, None]
+        log = None
+        if hasattr(self, 'log_content'):
+            log = '\r\n'.join(self.log_content)
+        write(path, x, y, log=log, dtype=dtype, subheaders=self._subheaders(), **header)
+
+    def _header_json(self):
+        """ Header metadata (and log) as a JSON string """
+        def jsonable(v):
+            if isinstance(v, bytes):
+                return v.decode('latin-1')
+            if isinstance(v, dict):
+                return dict((jsonable(k), jsonable(i)) for k, i in v.items())
+            if isinstance(v, list):
+                return [jsonable(i) for i in v]
+            return v
+
+        header = dict()
+        for k, v in vars(self).items():
+            if k.startswith('_') or k in ('sub', 'x', 'sub_index', 'content', 'log_content', 'mmap'):
+                continue
+            if isinstance(v, (bool, int, float, bytes, type(''), dict, list)):
+                header[k] = jsonable(v)
+        if hasattr(self, 'log_dict'):
+            header['log_dict'] = self.log_dict
+            header['log_other'] = self.log_other
+        return json.dumps(header, sort_keys=True)
 
     def print_metadata(self):
         """ Print out select metadata"""
-        print("Scan: ", self.log_dict['Comment'], "\n",
-              float(self.log_dict['Start']), "to ",
-              float(self.log_dict['End']), "; ",
-              float(self.log_dict['Increment']), "cm-1;",
-              float(self.log_dict['Integration Time']), "s integration time")
+        log = self.log_values
+        print("Scan: ", log['Comment'], "\n",
+              float(log['Start']), "to ",
+              float(log['End']), "; ",
+              float(log['Increment']), "cm-1;",
+              float(log['Integration Time']), "s integration time")
 
     def plot(self):
         """ Plots data, and use column headers, returns figure object plotted
@@ -645,9 +1334,7 @@ class File:
             for s in self.sub:
                 plt.plot(s.x, s.y)
         else:
-            x = self.x
-            for s in self.sub:
-                plt.plot(x, s.y)
+            plt.plot(self.x, self.y_matrix.T)
         plt.xlabel(self.xlabel)
         plt.ylabel(self.ylabel)
         return plt.gcf()
@@ -710,3 +1397,272 @@ class File:
         #    " points between ", self.ffirst, \
         #    " and ", self.flast, \
         #    " in steps of ", self.pr_spacing
+
+
+def _check_dtype(dtype):
+    """ Check the dtype option of File, giving None, 'native', 'raw' or a
+    numpy dtype """
+    if dtype is None or dtype in ('native', 'raw'):
+        return dtype
+    dtype = np.dtype(dtype)
+    if dtype.kind != 'f':
+        raise ValueError("dtype must be None, 'native', 'raw' or a floating point type, not %s"
+                         % dtype)
+    return dtype
+
+
+def _x_dtype(dtype, stored=np.float64):
+    """ dtype of the global x-data for the dtype option, stored is the type of
+    the x-data in the file (float64 if it is generated) """
+    if isinstance(dtype, np.dtype):
+        return dtype
+    if dtype is None:
+        return np.dtype(np.float64)
+    return np.dtype(stored)
+
+
+def _x_span(x, lo, hi):
+    """ Start and stop index of the points of increasing or decreasing x
+    between lo and hi """
+    lo, hi = min(lo, hi), max(lo, hi)
+    n = len(x)
+    if n == 0:
+        return 0, 0
+    if x[0] <= x[-1]:
+        return int(x.searchsorted(lo, 'left')), int(x.searchsorted(hi, 'right'))
+    # decreasing, search the reversed x
+    x = x[::-1]
+    return n - int(x.searchsorted(hi, 'right')), n - int(x.searchsorted(lo, 'left'))
+
+
+def _log_value(v):
+    """ Log value as an int or float if it is a number """
+    for t in (int, float):
+        try:
+            return t(v)
+        except ValueError:
+            pass
+    return v
+
+
+def read_header(filename, log=False):
+    """
+    Read only the header of a .SPC file (and optionally the log block),
+    without loading any of the data
+
+    Arguments
+    ---------
+    filename: str
+        path to the .SPC file
+    log: bool (default=False)
+        also read the log block, giving log_dict and log_other
+
+    Returns
+    -------
+    dict:
+        header fields, using the same names as the File data members,
+        including the decoded date (year, month, ...), labels and exp_type
+
+    Example
+    -------
+    >>> h = spc.read_header('/path/to/ftir.spc')
+    >>> h['exp_type'], h['fnpts'], h['fnsub']
+    """
+    with open(filename, "rb") as fin:
+        length = os.fstat(fin.fileno()).st_size
+        f = File._from_header(fin.read(File.head_siz), length)
+
+        if log and getattr(f, 'flogoff', 0):
+            fin.seek(f.flogoff)
+            f._read_log_head(fin.read(File.log_siz))
+            fin.seek(f.flogoff + f.logtxto)
+            f._read_log_text(fin.read(f.logsizd))
+
+    header = dict((k, v) for k, v in vars(f).items() if not k.startswith('_'))
+    if log and hasattr(f, 'log_dict'):
+        header['log_dict'] = f.log_dict
+        header['log_other'] = f.log_other
+    return header
+
+
+def iter_subfiles(filename, buffering=2**20, dtype=None):
+    """
+    Read the subfiles of a .SPC file one at a time, without loading the whole
+    file, so files larger than memory can be processed
+
+    Arguments
+    ---------
+    filename: str
+        path to the .SPC file
+    buffering: int (default=1MB)
+        buffer size of the file handle
+    dtype: str or dtype (default=None)
+        type of the decoded data, see File
+
+    Yields
+    ------
+    (x, sub): tuple
+        x-data for the subfile (the global x-data, or its own if the subfiles
+        have separate x-data) and the decoded subfile object, with the
+        subheader fields as data members
+
+    Example
+    -------
+    >>> for x, sub in spc.iter_subfiles('/path/to/kinetics.spc'):
+    ...     print(sub.subtime, sub.y.max())
+    """
+    dtype = _check_dtype(dtype)
+    with open(filename, "rb", buffering) as fin:
+        length = os.fstat(fin.fileno()).st_size
+        f = File._from_header(fin.read(File.head_siz), length)
+        subhead_siz = File.subhead_siz
+
+        # --------------------------------------------
+        # NEW FORMAT (LSB or MSB)
+        # --------------------------------------------
+        if f.fversn in (b'\x4b', b'\x4c'):
+            end = f._endian
+            # y data is 2 bytes per point if 16 bit, otherwise 4 bytes
+            y_siz = 2 if f.tsprec else 4
+
+            # if subfile directory is given
+            if f.dat_fmt == '-xy' and f.fnpts > 0:
+                fin.seek(f.fnpts)
+                sub_dir = np.frombuffer(fin.read(12 * f.fnsub), File.dir_dtype.newbyteorder(end))
+                prev = None
+                for ssfposn, ssfsize in zip(sub_dir['ssfposn'].tolist(), sub_dir['ssfsize'].tolist()):
+                    fin.seek(ssfposn)
+                    # load defaults for npts and exp
+                    sub = subFile(fin.read(ssfsize), 0, 0, True, f.tsprec, f.tmulti,
+                                  decode=False, endian=end, dtype=dtype)
+                    prev = _decode_shared_x(sub, prev)
+                    yield sub.x, sub
+                return
+
+            if f.txvals:
+                # global x data follows the header
+                x = np.frombuffer(fin.read(4 * f.fnpts), end + 'f4').astype(
+                    _x_dtype(dtype, np.float32))
+            elif not f.txyxys:
+                x = evenAxis(f.ffirst, f.flast, f.fnpts, _x_dtype(dtype))
+
+            prev = None
+            for i in range(f.fnsub):
+                subhead = fin.read(subhead_siz)
+                if f.txyxys:
+                    # use points in subfile, x and y data
+                    dat_siz = (4 + y_siz) * read_subheader(subhead, end)[6]
+                else:
+                    dat_siz = y_siz * f.fnpts
+                sub = subFile(subhead + fin.read(dat_siz),
+                              f.fnpts, f.fexp, f.txyxys, f.tsprec, f.tmulti,
+                              decode=not f.txyxys, endian=end, dtype=dtype)
+                if f.txyxys:
+                    prev = _decode_shared_x(sub, prev)
+                    x = sub.x
+                yield x, sub
+
+        # --------------------------------------------
+        # OLD FORMAT
+        # --------------------------------------------
+        elif f.fversn == b'\x4d':
+            x = evenAxis(f.ofirst, f.olast, f.onpts, _x_dtype(dtype))
+
+            # already have subheader from main header, retrace steps
+            fin.seek(File.old_head_siz - subhead_siz)
+            for i in range(f.fnsub):
+                subhead = fin.read(subhead_siz)
+                pts = read_subheader(subhead)[6]
+                if pts <= 0:
+                    # default to subfile points, unless it is zero
+                    pts = f.onpts
+                data = fin.read(4 * pts)
+                if len(data) < 4 * pts:
+                    # truncated subfile, stop here
+                    break
+                yield x, subFileOld(subhead + data, pts, f.oexp, f.txyxys, dtype)
+
+        else:
+            logger.warning('%s: File type %s not supported for streaming yet. Please add issue.',
+                           filename, hex(ord(f.fversn)))
+
+
+def _decode_shared_x(sub, prev):
+    """ Decode a -xy subfile created with decode=False, sharing the x array
+    of the previous subfile if they have the same x-data. prev is what this
+    returned for the previous subfile, or None """
+    key = sub._x_key()
+    if prev is not None and prev[0] == key:
+        prev[1].flags.writeable = False
+        sub.x = prev[1]
+    sub._decode()
+    return key, sub.x
+
+
+def load_many(filenames, workers=4, max_inflight=None, ordered=True, **kwargs):
+    """
+    Load many .SPC files using a pool of threads, overlapping the file I/O and
+    decoding of different files. Errors are given in place of the File
+    instead of being raised, so one bad file doesn't stop the rest.
+
+    Arguments
+    ---------
+    filenames: iterable of str
+        paths to the .SPC files, only taken when there is room to load them
+    workers: int (default=4)
+        number of threads
+    max_inflight: int (default=2*workers)
+        most files being loaded or loaded but not yet taken at any time, this
+        bounds the memory used
+    ordered: bool (default=True)
+        give the files in the order of filenames, otherwise as they finish
+        loading
+    **kwargs:
+        passed on to File, e.g. mmap or stats
+
+    Yields
+    ------
+    (filename, File or Exception): tuple
+
+    Example
+    -------
+    >>> for path, f in spc.load_many(paths, workers=8):
+    ...     if isinstance(f, Exception):
+    ...         print('Error processing', path, f)
+    """
+    if max_inflight is None:
+        max_inflight = 2 * workers
+    if workers < 1 or max_inflight < 1:
+        raise ValueError("workers and max_inflight must be at least 1")
+
+    slots = threading.Semaphore(max_inflight)
+    stopped = []
+
+    def feed():
+        # runs in the pool's task thread, waits for a slot before each file
+        for filename in filenames:
+            slots.acquire()
+            if stopped:
+                return
+            yield filename
+
+    pool = ThreadPool(workers)
+    try:
+        imap = pool.imap if ordered else pool.imap_unordered
+        for res in imap(partial(_load, kwargs=kwargs), feed()):
+            yield res
+            # file has been taken, make room for another
+            slots.release()
+    finally:
+        # wake the task thread if it is waiting, so it can stop
+        stopped.append(True)
+        slots.release()
+        pool.terminate()
+
+
+def _load(filename, kwargs):
+    """ Load a file for load_many, giving the exception if it fails """
+    try:
+        return filename, File(filename, **kwargs)
+    except Exception as e:
+        return filename, e
@@ -0,0 +1,66 @@
+"""
+loadStats class: timings and sizes collected while loading a file
+
+author: Rohan Isaac
+"""
+
+from __future__ import division, absolute_import, unicode_literals, print_function
+
+import timeit
+
+
+class loadStats(object):
+    """
+    Where the time goes when loading a file, filled in by File when it is
+    created with stats=True
+
+    Data
+    ----
+    times: seconds spent in each phase of loading
+        read: reading (or memory mapping) the file
+        header: parsing the main header
+        subfiles: indexing the subfiles and decoding their data
+        log: reading the log block header, the text is only read and
+            parsed when it is first used
+    bytes_read: bytes read from the file, for memory mapped files only the
+        parts that have been used (header, subfiles read so far and log)
+    nsub: number of subfiles
+    decoded_bytes: memory used by the decoded x and y arrays at the end of
+        loading
+
+    Example
+    -------
+    >>> f = spc.File('/path/to/map.spc', stats=True)
+    >>> f.stats.times['subfiles'], f.stats.bytes_read
+    """
+
+    phases = ('read', 'header', 'subfiles', 'log')
+
+    def __init__(self):
+        self.times = dict((p, 0.0) for p in self.phases)
+        self.bytes_read = 0
+        self.nsub = 0
+        self.decoded_bytes = 0
+        self._last = timeit.default_timer()
+
+    def lap(self, phase):
+        """ Add the time since the previous lap to phase """
+        now = timeit.default_timer()
+        self.times[phase] += now - self._last
+        self._last = now
+
+    @property
+    def total(self):
+        """ Total seconds spent loading """
+        return sum(self.times.values())
+
+    def as_dict(self):
+        """ Stats as a dictionary, e.g. to log as JSON """
+        return {'times': dict(self.times), 'total': self.total,
+                'bytes_read': self.bytes_read, 'nsub': self.nsub,
+                'decoded_bytes': self.decoded_bytes}
+
+    def __repr__(self):
+        times = ', '.join('%s=%.6f' % (p, self.times[p]) for p in self.phases)
+        return 'loadStats(%s, bytes_read=%i, nsub=%i, decoded_bytes=%i)' \
+            % (times, self.bytes_read, self.nsub, self.decoded_bytes)
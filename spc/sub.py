@@ -6,26 +6,40 @@ author: Rohan Isaac
 
 from __future__ import division, absolute_import, unicode_literals, print_function
 
-import struct
 import numpy as np
 
-from .global_fun import read_subheader
+from .global_fun import read_subheader, convert_data, scale_data, scale_dtype
 
 
-class subFile:
+class subFile(object):
     """
     Processes each subfile passed to it, extracts header information and data
     information and places them in data members
 
+    If lazy is set, the x and y data are only decoded on first access, and
+    floating y-data is returned as a read-only float32 view into data. If
+    decode is not set, the caller is expected to decode the data itself
+    (e.g. into a row of a larger array). endian is the byte order of the data,
+    '<' for LSB files and '>' for MSB files. x is already decoded x-data to use
+    instead of decoding it, e.g. shared with another subfile
+
+    dtype sets the type of the decoded data: None for float64 (int64 for
+    integer data scaled by a whole number), 'native' for the smallest float
+    holding the stored data exactly (float32 for floating and 16 bit data),
+    'raw' for the y-data as stored (scale it by y_scale, x-data is scaled as
+    for None), or a floating point numpy dtype
+
     Data
     ----
     x: x-data (optional)
     y: y-data
-    y_int: integer y-data if y-data is not floating
+    exp: exponent of the integer data (128 for floating data)
+    y_scale: factor to multiply raw y-data by
 
     """
 
-    def __init__(self, data, fnpts, fexp, txyxy, tsprec, tmulti):
+    def __init__(self, data, fnpts, fexp, txyxy, tsprec, tmulti, lazy=False, decode=True,
+                 endian='<', dtype=None, x=None):
 
         # extract subheader info
         self.subflgs, \
@@ -38,10 +52,7 @@ class subFile:
             self.subscan, \
             self.subwlevel, \
             self.subresv \
-            = read_subheader(data[:32])
-
-        # header is 32 bytes
-        y_dat_pos = 32
+            = read_subheader(data[:32], endian)
 
         if txyxy:
             # only reason to use subnpts if x data is here
@@ -61,63 +72,180 @@ class subFile:
         if not (-128 < exp <= 128):
             exp = 0
 
+        self._data = data
+        self._pts = pts
+        self._exp = exp
+        self._txyxy = txyxy
+        self._tsprec = tsprec
+        self._lazy = lazy
+        self._endian = endian
+        self._dtype = dtype
+        self._x = x
+        self._y = None
+
+        if decode and not lazy:
+            self._decode()
+
+    def _decode(self, y_out=None):
+        """ Decode the x and y data from the raw subfile data, optionally
+        writing y into the array y_out """
+        data = self._data
+        pts = self._pts
+        exp = self._exp
+        end = self._endian
+
+        # header is 32 bytes
+        y_dat_pos = 32
+
         # --------------------------
         # if x_data present
         # --------------------------
-        if txyxy:
-            x_str = '<' + 'i' * pts
+        if self._txyxy:
             x_dat_pos = y_dat_pos
             x_dat_end = x_dat_pos + (4 * pts)
 
-            x_raw = np.array(struct.unpack(x_str.encode('utf8'), data[x_dat_pos:x_dat_end]))
-            self.x = (2**(exp - 32)) * x_raw
+            if self._x is None:
+                x_raw = np.frombuffer(data, end + 'i4', pts, x_dat_pos)
+                self._x = convert_data(x_raw, exp - 32, self._x_dtype())
 
             y_dat_pos = x_dat_end
 
         # --------------------------
         # extract y_data
         # --------------------------
-        y_dat_str = '<'
+        # read straight from the buffer as a typed array, then scale in place
         if exp == 128:
-            # Floating y-values
-            y_dat_str += 'f' * pts
-            y_dat_end = y_dat_pos + (4 * pts)
-            y_raw = np.array(struct.unpack(y_dat_str.encode('utf8'), data[y_dat_pos:y_dat_end]))
-            self.y = y_raw
+            # Floating y-values, no scaling needed
+            y_raw = np.frombuffer(data, end + 'f4', pts, y_dat_pos)
         else:
-            # integer format
-            # lydata = len(data) - y_dat_pos
-            if tsprec:
-                # 16 bit
-                y_dat_str += 'h' * pts  # short
-                y_dat_end = y_dat_pos + (2 * pts)
-                y_raw = np.array(struct.unpack(y_dat_str.encode('utf8'), data[y_dat_pos:y_dat_end]))
-                self.y = (2**(exp - 16)) * y_raw
-            else:
-                # 32 bit, using size of subheader to figure out data type
-                # actually there is flag for this, use it instead
-                # self.tsprec
-                y_dat_str += 'i' * pts
-                y_dat_end = y_dat_pos + (4 * pts)
-                y_raw = np.array(struct.unpack(y_dat_str.encode('utf8'), data[y_dat_pos:y_dat_end]))
-                self.y = (2**(exp - 32)) * y_raw
-
-
-class subFileOld:
+            # integer format, 16 or 32 bit
+            y_raw = np.frombuffer(data, '%si%i' % (end, self._bits // 8), pts, y_dat_pos)
+        y_shift = None if exp == 128 or self._dtype == 'raw' else exp - self._bits
+        # keep the view into the data if lazy and it already has the type
+        self._y = convert_data(y_raw, y_shift, self.y_dtype, y_out, view=self._lazy)
+
+        # raw data is no longer needed
+        self._data = None
+
+    def _x_key(self):
+        """ Exponent and raw bytes of the x-data, equal for subfiles with the
+        same x-data, only available before decoding """
+        return self._exp, bytes(self._data[32:32 + 4 * self._pts])
+
+    @classmethod
+    def _from_decoded(cls, subhead, x, y):
+        """ Subfile from already decoded data (e.g. from a cache) and its
+        subheader as a File.subhead_dtype record, x is None if the subfile has
+        no x-data """
+        self = cls.__new__(cls)
+        self.subflgs, \
+            self.subexp, \
+            self.subindx, \
+            self.subtime, \
+            self.subnext, \
+            self.subnois, \
+            self.subnpts, \
+            self.subscan, \
+            self.subwlevel, \
+            self.subresv \
+            = subhead.tolist()
+        # null bytes are stripped from the record
+        self.subresv = self.subresv.ljust(4, b'\x00')
+
+        self._data = None
+        self._pts = len(y)
+        self._exp = self.subexp
+        self._txyxy = x is not None
+        self._tsprec = False
+        self._lazy = False
+        self._endian = '<'
+        self._dtype = y.dtype
+        self._x = x
+        self._y = y
+        return self
+
+    @property
+    def _bits(self):
+        """ Size of integer y-data in bits """
+        return 16 if self._tsprec else 32
+
+    @property
+    def exp(self):
+        """ Exponent of the integer data, 128 for floating data """
+        return self._exp
+
+    @property
+    def y_scale(self):
+        """ Factor to multiply the raw (dtype='raw') y-data by """
+        if self._exp == 128:
+            return 1.0
+        return 2.0**(self._exp - self._bits)
+
+    @property
+    def y_dtype(self):
+        """ dtype of the decoded y-data """
+        if self._y is not None:
+            return self._y.dtype
+        if isinstance(self._dtype, np.dtype):
+            return self._dtype
+        if self._exp == 128:
+            if self._dtype is None and not self._lazy:
+                return np.dtype(np.float64)
+            return np.dtype(np.float32)
+        if self._dtype == 'raw':
+            return np.dtype('i%i' % (self._bits // 8))
+        if self._dtype == 'native':
+            return np.dtype(np.float32 if self._tsprec else np.float64)
+        return scale_dtype(self._exp - self._bits)
+
+    def _x_dtype(self):
+        """ dtype of the decoded x-data """
+        if isinstance(self._dtype, np.dtype):
+            return self._dtype
+        return scale_dtype(self._exp - 32)
+
+    @property
+    def x(self):
+        if not self._txyxy:
+            raise AttributeError("subfile has no x data, use the global x")
+        if self._x is None:
+            self._decode()
+        return self._x
+
+    @x.setter
+    def x(self, value):
+        self._x = value
+
+    @property
+    def y(self):
+        if self._y is None:
+            self._decode()
+        return self._y
+
+    @y.setter
+    def y(self, value):
+        self._y = value
+
+
+class subFileOld(object):
     """
     Processes each subfile passed to it, extracts header information and data
     information and places them in data members.
 
     Used for the old format where the y-values are stored in an odd way
 
+    dtype sets the type of the decoded data, as for subFile
+
     Data
     ----
     x: x-data (optional)
     y: y-data
+    exp: exponent of the integer data (128 for floating data)
+    y_scale: factor to multiply raw y-data by
 
     """
 
-    def __init__(self, data, pts, fexp, txyxy):
+    def __init__(self, data, pts, fexp, txyxy, dtype=None):
         # fixed header size
         y_dat_pos = 32
 
@@ -151,12 +279,14 @@ class subFileOld:
         # --------------------------
 
         if txyxy:
-            x_str = 'i' * pts
             x_dat_pos = y_dat_pos
             x_dat_end = x_dat_pos + (4 * pts)
 
-            x_raw = np.array(struct.unpack(x_str.encode('utf8'), data[x_dat_pos:x_dat_end]))
-            self.x = (2**(exp - 32)) * x_raw
+            x_raw = np.frombuffer(data, '<i4', pts, x_dat_pos)
+            if isinstance(dtype, np.dtype):
+                self.x = convert_data(x_raw, exp - 32, dtype)
+            else:
+                self.x = scale_data(x_raw, exp - 32)
 
             y_dat_pos = x_dat_end
 
@@ -164,31 +294,74 @@ class subFileOld:
         # extract y_data
         # --------------------------
 
+        self.exp = 128 if yfloat else exp
+        self.y_scale = 1.0 if yfloat else 2.0**(exp - 32)
+
         # assuming can't have 2 byte y-values, !! fix maybe
-        y_dat_end = y_dat_pos + (4 * pts)
         if yfloat:
             # floats are pretty straigtfoward
-            y_dat_str = '<' + 'f' * pts
-            y_raw = struct.unpack(y_dat_str.encode('utf8'), data[y_dat_pos:y_dat_end])
-            self.y = y_raw
+            y_raw = np.frombuffer(data, '<f4', pts, y_dat_pos)
+            if dtype in ('native', 'raw'):
+                self.y = y_raw.copy()
+            else:
+                self.y = y_raw.astype(dtype or np.float64)
         else:
-            # for old format, extract the entire array out as 1 bit unsigned
-            # integers, swap 1st and 2nd byte, as well as 3rd and 4th byte to get
-            # the final integer then scale by the exponent
-            y_dat_str = '>' + 'B' * 4 * pts
-            y_raw = struct.unpack(y_dat_str.encode('utf8'), data[y_dat_pos:y_dat_end])
-
-            y_int = []
-            for i in range(0, len(y_raw), 4):
-                y_int.append((
-                    y_raw[i + 1] * (256**3) + y_raw[i] * (256**2) +
-                    y_raw[i + 3] * (256) + y_raw[i + 2]))
-            # fix negative values by casting to np.int32 (signed int)
-            y_int = np.int32(y_int) / (2**(32 - exp))
-
-            self.y = y_int
+            # for old format, the integers are stored as two little endian
+            # 16 bit words with the most significant word first; swap the words
+            # and view the result as (signed) 32 bit integers, then scale by
+            # the exponent
+            y_raw = np.frombuffer(data, '<u2', 2 * pts, y_dat_pos).reshape(-1, 2)
+            y_int = y_raw[:, ::-1].copy().view('<i4').ravel()
+
+            if dtype == 'raw':
+                self.y = y_int
+            elif isinstance(dtype, np.dtype):
+                self.y = convert_data(y_int, exp - 32, dtype)
+            else:
+                self.y = y_int / (2**(32 - exp))
+
+        self._pts = pts
 
         # do stuff if subflgs
         # if 1 subfile changed
         # if 8 if peak table should not be used
         # if 128 if subfile modified by arithmetic
+
+    @property
+    def y_dtype(self):
+        """ dtype of the decoded y-data """
+        return self.y.dtype
+
+
+class subList(object):
+    """
+    Sequence of subfiles that are only read when they are first accessed,
+    used in place of a list of subFile objects for large files
+
+    Data
+    ----
+    n: number of subfiles
+    read_sub: function returning the subfile object for an index
+
+    """
+
+    def __init__(self, n, read_sub):
+        self._read_sub = read_sub
+        self._subs = [None] * n
+
+    def __len__(self):
+        return len(self._subs)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return [self[i] for i in range(*key.indices(len(self)))]
+        sub = self._subs[key]
+        if sub is None:
+            # normalize negative indices before reading
+            key = range(len(self))[key]
+            sub = self._subs[key] = self._read_sub(key)
+        return sub
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
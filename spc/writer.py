@@ -0,0 +1,278 @@
+"""
+SPC writer: encodes data into the new format (LSB) .SPC file layout
+
+author: Rohan Isaac
+"""
+
+from __future__ import division, absolute_import, unicode_literals, print_function
+
+import struct
+import numpy as np
+
+from .spc import File
+
+# header fields that can be set with keyword arguments, and their defaults
+header_defaults = [('fexper', 0), ('fxtype', 0), ('fytype', 0), ('fztype', 0), ('fpost', 0),
+                   ('fdate', 0), ('fres', b''), ('fsource', b''), ('fpeakpt', 0), ('fspare', b''),
+                   ('fcmnt', b''), ('fcatxt', b''), ('fmods', 0), ('fprocs', 0), ('flevel', 0),
+                   ('fsampin', 0), ('ffactor', 0.0), ('fmethod', b''), ('fzinc', 0.0),
+                   ('fwplanes', 0), ('fwinc', 0.0), ('fwtype', 0)]
+
+# flag bits that can be set with keyword arguments
+flag_defaults = [('tcgram', False), ('trandm', False), ('tordrd', False), ('talabs', False)]
+
+
+def write(filename, x, y, z=None, log=None, dtype='float', subheaders=None, msb=False,
+          **header):
+    """
+    Write data to a new format .SPC file, LSB (little-endian) unless msb is
+    set
+
+    The layout is chosen from the data: gx-y if x is evenly spaced, x-y if it
+    is not, and -xy (with a subfile directory) if x holds an array for each
+    subfile (a list of arrays or a 2D array).
+
+    Arguments
+    ---------
+    filename: str
+        path of the .SPC file to write
+    x: ndarray or list of ndarray
+        x-data shared by all subfiles (1D), or the x-data of each subfile
+    y: ndarray or list of ndarray
+        y-data, 1D for a single subfile, 2D (fnsub, fnpts) or a list of
+        arrays for multiple subfiles
+    z: ndarray (default=None)
+        z-value (subtime) of each subfile
+    log: dict, str or bytes (default=None)
+        log block text, written as given, dictionaries are written as
+        key=value lines
+    dtype: str (default='float')
+        'float' stores y as 32 bit floats, 'int' stores y as 32 bit integers
+        scaled by a power of two exponent for each subfile, and 'int16' as
+        16 bit scaled integers. -xy files are always stored as scaled
+        integers ('float' gives 32 bit), with x and y sharing the exponent.
+        Integers can't store NaN or infinite values, ValueError is raised
+        for those
+    subheaders: ndarray (default=None)
+        structured array of File.subhead_dtype to take the other subheader
+        fields from (e.g. subnext, subnois, subscan, subwlevel)
+    msb: bool (default=False)
+        write the big-endian (MSB 1st, 0x4c) version of the format
+    **header:
+        header fields named as the File data members, e.g. fexper, fxtype,
+        fytype, fztype, fdate, fres, fsource, fcmnt, fcatxt, and the flags
+        tcgram, trandm, tordrd and talabs
+
+    Example
+    -------
+    >>> x = np.linspace(400, 4000, 1000)
+    >>> spc.write('/path/to/out.spc', x, np.vstack(spectra), fxtype=1, fcmnt='merged')
+    """
+    if dtype not in ('float', 'int', 'int16'):
+        raise ValueError("dtype must be 'float', 'int' or 'int16', not %r" % (dtype,))
+    # 16 bit y data
+    tsprec = dtype == 'int16'
+    y_bits = 16 if tsprec else 32
+    # byte order
+    end = '>' if msb else '<'
+
+    values = dict(header_defaults)
+    values.update(flag_defaults)
+    for k, v in header.items():
+        if k not in values:
+            raise TypeError("write() got an unexpected keyword argument '%s'" % k)
+        values[k] = v
+
+    # -xy if x holds an array for each subfile
+    if isinstance(x, (list, tuple)):
+        txyxys = len(x) > 0 and np.ndim(x[0]) > 0
+    else:
+        txyxys = np.ndim(x) > 1
+    if txyxys:
+        x = [np.asarray(i, np.float64) for i in x]
+        y = [np.asarray(i, np.float64) for i in y]
+        fnsub = len(y)
+    else:
+        x = np.asarray(x, np.float64)
+        y = np.atleast_2d(np.asarray(y, np.float64))
+        fnsub, fnpts = y.shape
+
+    # subheaders
+    subhead = np.zeros(fnsub, File.subhead_dtype.newbyteorder(end))
+    if subheaders is not None:
+        subhead[...] = subheaders
+    subhead['subindx'] = np.arange(fnsub)
+    if z is not None:
+        subhead['subtime'] = z
+
+    # multiple subfiles have their own exponents, required for -xy
+    tmulti = fnsub > 1 or txyxys
+    txvals = False
+
+    if txyxys:
+        # --------------------------
+        # each subfile has its own x data, followed by a directory
+        # --------------------------
+        sub_data = []
+        for i in range(fnsub):
+            _check_finite(x[i], 'x')
+            _check_finite(y[i], 'y')
+            exp = int(_int_exp(max(_max_abs(x[i]), _max_abs(y[i]))))
+            subhead['subexp'][i] = exp
+            subhead['subnpts'][i] = len(y[i])
+            sub_data.append(subhead[i:i + 1].tobytes() +
+                            _int_encode(x[i], exp, 32, end).tobytes() +
+                            _int_encode(y[i], exp, y_bits, end).tobytes())
+
+        fexp = 0
+        x_all = [i for i in x if len(i)]
+        ffirst = min(i.min() for i in x_all) if x_all else 0.0
+        flast = max(i.max() for i in x_all) if x_all else 0.0
+
+        sub_pos = File.head_siz + np.cumsum([0] + [len(d) for d in sub_data])
+        sub_dir = np.zeros(fnsub, File.dir_dtype.newbyteorder(end))
+        sub_dir['ssfposn'] = sub_pos[:-1]
+        sub_dir['ssfsize'] = [len(d) for d in sub_data]
+        sub_dir['ssftime'] = subhead['subtime']
+
+        # for -xy files fnpts is the position of the directory
+        fnpts = int(sub_pos[-1])
+        data = b''.join(sub_data) + sub_dir.tobytes()
+    else:
+        # --------------------------
+        # x data is shared
+        # --------------------------
+        if len(x) != fnpts:
+            raise ValueError("x has %i points, y has %i" % (len(x), fnpts))
+        ffirst = x[0] if fnpts else 0.0
+        flast = x[-1] if fnpts else 0.0
+
+        x_dat = b''
+        if fnpts > 2 and not np.allclose(np.diff(x), (flast - ffirst) / (fnpts - 1),
+                                         rtol=1e-6, atol=0):
+            # not evenly spaced, x data follows the header
+            txvals = True
+            x_dat = x.astype(end + 'f4').tobytes()
+
+        # encode all the subfiles at once, each record is a subheader followed
+        # by the y data
+        if dtype == 'float':
+            fexp = 128
+            subhead['subexp'] = fexp
+            rec = np.zeros(fnsub, [('head', subhead.dtype), ('y', end + 'f4', (fnpts,))])
+            rec['y'] = y
+        else:
+            _check_finite(y, 'y')
+            exp = _int_exp(np.max(np.abs(y), axis=1) if fnpts else np.zeros(fnsub))
+            fexp = int(exp.max()) if fnsub else 0
+            subhead['subexp'] = exp
+            rec = np.zeros(fnsub, [('head', subhead.dtype),
+                                   ('y', '%si%i' % (end, y_bits // 8), (fnpts,))])
+            rec['y'] = _int_encode(y, exp[:, None], y_bits, end)
+        if not tmulti:
+            # the global exponent is used for a single subfile
+            subhead['subexp'] = fexp
+        rec['head'] = subhead
+        data = x_dat + rec.tobytes()
+
+    # --------------------------
+    # log block at the end
+    # --------------------------
+    log_dat = b''
+    flogoff = 0
+    if log is not None:
+        flogoff = File.head_siz + len(data)
+        log_dat = _log_block(log, end)
+
+    # --------------------------
+    # header
+    # --------------------------
+    flags = [tsprec, values['tcgram'], tmulti, values['trandm'], values['tordrd'],
+             values['talabs'], txyxys, txvals]
+    ftflg = sum(1 << i for i, f in enumerate(flags) if f)
+
+    head = struct.pack(
+        (end + File.head_str[1:]).encode('utf8'),
+        _char(ftflg), b'\x4c' if msb else b'\x4b', _char(values['fexper']), _char(fexp), fnpts,
+        float(ffirst), float(flast), fnsub,
+        _char(values['fxtype']), _char(values['fytype']), _char(values['fztype']),
+        _char(values['fpost']), values['fdate'],
+        _bytes(values['fres']), _bytes(values['fsource']), values['fpeakpt'],
+        _bytes(values['fspare']), _bytes(values['fcmnt']), _bytes(values['fcatxt']),
+        flogoff, values['fmods'], _char(values['fprocs']), _char(values['flevel']),
+        values['fsampin'], values['ffactor'], _bytes(values['fmethod']), values['fzinc'],
+        values['fwplanes'], values['fwinc'], _char(values['fwtype']), b'')
+
+    with open(filename, 'wb') as f:
+        f.write(head)
+        f.write(data)
+        f.write(log_dat)
+
+
+# ------------------------------------------------------------------------
+# Encoding helpers
+# ------------------------------------------------------------------------
+
+
+def _char(n):
+    """ Single byte for a 'c' header field """
+    if isinstance(n, bytes):
+        return n[:1].ljust(1, b'\x00')
+    return struct.pack(b'B', int(n))
+
+
+def _bytes(s):
+    """ Bytes for a string header field """
+    if isinstance(s, bytes):
+        return s
+    return s.encode('latin-1')
+
+
+def _max_abs(a):
+    """ Largest absolute value in a, zero if empty """
+    return np.abs(a).max() if len(a) else 0.0
+
+
+def _check_finite(a, name):
+    """ Raise ValueError if a has values that can't be scaled to integers """
+    if not np.all(np.isfinite(a)):
+        raise ValueError("%s-data has NaN or infinite values, which can't be stored as "
+                         "integers (only dtype='float' gx-y and x-y files can)" % name)
+
+
+def _int_exp(max_abs):
+    """ Smallest exponent that fits max_abs into a scaled 32 bit integer """
+    max_abs = np.asarray(max_abs, np.float64)
+    with np.errstate(divide='ignore'):
+        exp = np.floor(np.log2(max_abs)) + 2
+    # exponents below zero can't be read back, 128 flags floating data
+    exp = np.clip(np.where(max_abs > 0, exp, 0), 0, 127)
+    return exp.astype(np.int64)
+
+
+def _int_encode(a, exp, bits=32, end='<'):
+    """ Scale data by 2**(bits - exp) and round to bits sized integers, in
+    end byte order """
+    scaled = np.rint(a * np.exp2(bits - exp))
+    lim = 2**(bits - 1)
+    return np.clip(scaled, -lim, lim - 1).astype('%si%i' % (end, bits // 8))
+
+
+def _log_block(log, end='<'):
+    """ Log block header and text """
+    if isinstance(log, dict):
+        lines = []
+        for k, v in log.items():
+            k = k.decode('latin-1') if isinstance(k, bytes) else '{}'.format(k)
+            v = v.decode('latin-1') if isinstance(v, bytes) else '{}'.format(v)
+            lines.append('{}={}'.format(k, v))
+        log = ''.join(line + '\r\n' for line in lines)
+    text = _bytes(log)
+
+    logtxto = File.log_siz
+    logsizd = logtxto + len(text)
+    # memory block is a multiple of 4096 bytes
+    logsizm = 4096 * ((logsizd + 4095) // 4096)
+    head = struct.pack((end + File.logstc_str[1:]).encode('utf8'),
+                       logsizd, logsizm, logtxto, 0, 0, b'')
+    return head + text
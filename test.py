@@ -1,7 +1,11 @@
 #!/usr/bin/env python
 from __future__ import absolute_import, unicode_literals, print_function, division
 import os
+import shutil
+import tempfile
+import numpy as np
 import spc
+import benchmark
 
 tfile = 0
 tpass = 0
@@ -10,6 +14,8 @@ dpath = os.path.join(os.path.dirname(__file__), 'test_data')
 mfile = []
 rfile = []
 lfile = []
+wfile = []
+tmpdir = tempfile.mkdtemp()
 for i in os.listdir(dpath):
     if i[-3:].lower() == 'spc':
         tfile += 1
@@ -24,7 +30,234 @@ for i in os.listdir(dpath):
             else:
                 print("Fail\n------")
                 mfile.append(i)
+
+        # write out and read back in
+        spcfile = os.path.join(tmpdir, i)
+        f1.save(spcfile)
+        f2 = spc.File(spcfile)
+        for s1, s2 in zip(f1.sub, f2.sub):
+            if not np.allclose(s1.y, s2.y, rtol=1e-6, atol=0):
+                wfile.append(i)
+                break
+
+        # raw data is scaled when written out
+        spc.File(os.path.join(dpath, i), dtype='raw').save(spcfile)
+        f2 = spc.File(spcfile)
+        for s1, s2 in zip(f1.sub, f2.sub):
+            if not np.allclose(s1.y, s2.y, rtol=1e-6, atol=0) or \
+                    (f1.txyxys and not np.array_equal(s1.x, s2.x)):
+                wfile.append(i + ' (raw)')
+                break
+
+# the layout is chosen from the data, plain lists are a single subfile
+spcfile = os.path.join(tmpdir, 'write.spc')
+for x, y, fmt in [([1.0, 2.0, 3.0], [4.0, 5.0, 6.0], 'gx-y'),
+                  ((1.0, 2.0, 4.0), [4.0, 5.0, 6.0], 'x-y'),
+                  ([[1.0, 2.0, 4.0], [1.0, 2.0]], [[4.0, 5.0, 6.0], [7.0, 8.0]], '-xy')]:
+    spc.write(spcfile, x, y)
+    f1 = spc.File(spcfile)
+    if fmt != '-xy':
+        x, y = [x], [y]
+    xs = [s.x for s in f1.sub] if f1.txyxys else [f1.x]
+    ys = [s.y for s in f1.sub]
+    if f1.dat_fmt != fmt or len(ys) != len(y) or \
+            not all(np.allclose(a, b) for a, b in zip(xs + ys, list(x) + list(y))):
+        wfile.append('write %s' % fmt)
+
+# integers can't hold NaN, which must not be written as some other value
+for dtype in ('int', 'int16'):
+    try:
+        spc.write(spcfile, [1.0, 2.0, 3.0], [1.0, np.nan, 3.0], dtype=dtype)
+        wfile.append('write NaN as %s' % dtype)
+    except ValueError:
+        pass
+
+# evenly spaced x-data should behave like the array it stands in for
+afile = []
+array_ops = [np.min, np.max, np.mean, np.sum, np.argmin, np.argmax, np.diff, np.sort,
+             lambda x: x.min(), lambda x: x.max(), lambda x: x.mean(), lambda x: x.sum(),
+             lambda x: x.argmin(), lambda x: x.reshape(-1, 1), lambda x: x.T,
+             lambda x: x.nbytes, lambda x: x.astype(np.float32, copy=False),
+             lambda x: x.copy(), lambda x: x.tolist(), lambda x: x[::-3], lambda x: x * 2 + 1,
+             lambda x: np.min(x, axis=0), lambda x: np.searchsorted(np.sort(x), 1000.0)]
+for i in os.listdir(dpath):
+    if i[-3:].lower() == 'spc':
+        f1 = spc.File(os.path.join(dpath, i))
+        if not isinstance(getattr(f1, 'x', None), spc.axis.evenAxis):
+            continue
+        xa = np.array(f1.x)
+        for op in array_ops:
+            try:
+                if not np.array_equal(np.asarray(op(f1.x)), np.asarray(op(xa))):
+                    raise ValueError
+            except Exception:
+                afile.append(i)
+                break
+        # in-place operations make a new array
+        y = np.multiply(f1.x, 2, out=f1.x)
+        f1.x += 1
+        if not (np.array_equal(y, xa * 2) and np.array_equal(f1.x, xa + 1)):
+            afile.append(i)
+
+# loading part of a file should give the same data as slicing a full load
+pfile = []
+for i in os.listdir(dpath):
+    if i[-3:].lower() == 'spc':
+        path = os.path.join(dpath, i)
+        full = spc.File(path)
+        subs = [0, -1, 0]
+        nums = np.arange(full.fnsub)[subs]
+        for mmap in (False, True):
+            if full.txyxys:
+                f1 = spc.File(path, mmap=mmap, subs=subs)
+                same = len(f1.sub) == len(nums) and all(
+                    np.array_equal(s.x, full.sub[k].x) and np.array_equal(s.y, full.sub[k].y)
+                    for s, k in zip(f1.sub, nums))
+                try:
+                    spc.File(path, mmap=mmap, x_range=(0, 1))
+                    same = False
+                except ValueError:
+                    pass
+            else:
+                x = np.asarray(full.x)
+                n = len(x)
+                # given high to low, on increasing and decreasing x
+                hi, lo = x[n // 4], x[3 * n // 4]
+                keep = (x >= min(lo, hi)) & (x <= max(lo, hi))
+                f1 = spc.File(path, mmap=mmap, subs=subs, x_range=(hi, lo))
+                same = np.array_equal(f1.x, x[keep]) and \
+                    np.array_equal(f1.y_matrix, full.y_matrix[nums][:, keep]) and \
+                    all(np.array_equal(s.y, full.sub[k].y[keep]) for s, k in zip(f1.sub, nums))
+            same = same and np.array_equal(f1.sub_numbers, nums)
+            f1.close()
+            if not same:
+                pfile.append(i + (' mmap' if mmap else ''))
+
+# files from the cache should match a fresh load, from memory, from disk in a
+# new cache, and loaded again once changed
+kfile = []
+srcdir = os.path.join(tmpdir, 'src')
+cachedir = os.path.join(tmpdir, 'cache')
+os.mkdir(srcdir)
+for i in os.listdir(dpath):
+    if i[-3:].lower() == 'spc':
+        path = os.path.join(srcdir, i)
+        shutil.copy(os.path.join(dpath, i), path)
+        full = spc.File(path)
+        cache = spc.FileCache(directory=cachedir)
+        cache1 = spc.FileCache(directory=cachedir)
+        loads = [cache.load(path), cache.load(path), cache1.load(path)]
+        counts = [dict(cache.counts), dict(cache1.counts)]
+        # a changed file is not taken from memory or disk
+        st = os.stat(path)
+        os.utime(path, (st.st_atime, st.st_mtime + 10))
+        cache2 = spc.FileCache(directory=cachedir)
+        loads += [cache.load(path), cache2.load(path)]
+        counts += [dict(cache.counts), dict(cache2.counts)]
+        same = loads[1] is loads[0] and counts == [
+            {'memory': 1, 'disk': 0, 'miss': 1}, {'memory': 0, 'disk': 1, 'miss': 0},
+            {'memory': 1, 'disk': 0, 'miss': 2},
+            {'memory': 0, 'disk': 1, 'miss': 0}]
+        for f1 in loads:
+            same = same and np.array_equal(getattr(f1, 'x', None), getattr(full, 'x', None)) \
+                and isinstance(getattr(f1, 'x', None), spc.axis.evenAxis) == \
+                isinstance(getattr(full, 'x', None), spc.axis.evenAxis) \
+                and np.array_equal(f1.y_matrix, full.y_matrix) \
+                and np.array_equal(getattr(f1, 'sub_numbers', None), full.sub_numbers) \
+                and f1.data_txt() == full.data_txt()
+        if not same:
+            kfile.append(i)
+
+# resampling all subfiles at once should match np.interp on each one
+ifile = []
+for i in os.listdir(dpath):
+    if i[-3:].lower() == 'spc':
+        f1 = spc.File(os.path.join(dpath, i))
+        xs = [s.x for s in f1.sub] if f1.txyxys else [np.asarray(f1.x)] * f1.fnsub
+        lo = min(np.min(x) for x in xs)
+        hi = max(np.max(x) for x in xs)
+        # past both ends, and the default grid
+        grids = [np.linspace(lo - (hi - lo) / 10, hi + (hi - lo) / 10, 301),
+                 f1.resample(n=200)[0]]
+        for grid in grids:
+            grid, y = f1.resample(grid)
+            ref = []
+            for x, s in zip(xs, f1.sub):
+                order = np.argsort(x, kind='stable')
+                ref.append(np.interp(grid, x[order], s.y[order], left=np.nan, right=np.nan))
+            if not np.allclose(y, ref, rtol=1e-10, atol=0, equal_nan=True):
+                ifile.append(i)
+                break
+
+# memory mapped data that wasn't read before close() can't be read after it
+cfile = []
+for i in os.listdir(dpath):
+    if i[-3:].lower() == 'spc':
+        f1 = spc.File(os.path.join(dpath, i), mmap=True)
+        f1.close()
+        try:
+            y = f1.y_matrix
+        except ValueError:
+            continue
+        # unless it was already read when loading
+        if not np.array_equal(y, spc.File(os.path.join(dpath, i)).y_matrix):
+            cfile.append(i)
+
+# big-endian (MSB 1st) files should read the same as their LSB twins
+efile = []
+lsbfile = os.path.join(tmpdir, 'lsb.spc')
+msbfile = os.path.join(tmpdir, 'msb.spc')
+for layout in benchmark.layouts:
+    if layout == 'old':
+        # only written LSB
+        continue
+    for ytype in benchmark.ytypes:
+        benchmark.make_file(lsbfile, layout, ytype, 5, 100)
+        benchmark.make_file(msbfile, layout, ytype, 5, 100, msb=True)
+        for mmap in (False, True):
+            f1 = spc.File(lsbfile, mmap=mmap)
+            f2 = spc.File(msbfile, mmap=mmap)
+            same = f2.fversn == b'\x4c' and f1.fnsub == f2.fnsub
+            for s1, s2 in zip(f1.sub, f2.sub):
+                x1 = s1.x if f1.txyxys else f1.x
+                x2 = s2.x if f2.txyxys else f2.x
+                same = same and np.array_equal(x1, x2) and np.array_equal(s1.y, s2.y) \
+                    and s1.subtime == s2.subtime
+            f1.close()
+            f2.close()
+            if not same:
+                efile.append('%s %s%s' % (layout, ytype, ' mmap' if mmap else ''))
+
+# Shimadzu files, with no specification, are found from the layout of known
+# files: y doubles, a gap of zeros, then as many x doubles
+sfile = []
+shimfile = os.path.join(tmpdir, 'shimadzu.spc')
+x = np.linspace(200.0, 800.0, 300)
+for nzero in (0, 1, 10):
+    # zero y values at the end look like the gap
+    y = np.sin(x / 50.0) + 2
+    if nzero:
+        y[-nzero:] = 0
+    with open(shimfile, 'wb') as fout:
+        fout.write(b'\x00\xcf' + bytes(bytearray(spc.File.shimadzu_pos - 2)))
+        fout.write(y.astype('<f8').tobytes() + bytes(bytearray(64)))
+        fout.write(x.astype('<f8').tobytes() + bytes(bytearray(64)))
+    for mmap in (False, True):
+        f1 = spc.File(shimfile, mmap=mmap)
+        if not (np.array_equal(f1.x, x) and np.array_equal(f1.sub[0].y, y)):
+            sfile.append('%i zeros%s' % (nzero, ' mmap' if mmap else ''))
+        f1.close()
+
+shutil.rmtree(tmpdir)
 print("Passed %i of %i tests. " % (tpass, tfile))
 print("Did not match ref file: ", mfile)
 print("Did not have ref file: ", rfile)
 print("Did not load file: ", lfile)
+print("Did not match after writing: ", wfile)
+print("x-data did not behave like an array: ", afile)
+print("Part of file did not match full file: ", pfile)
+print("Cached file did not match file: ", kfile)
+print("Resampled data did not match np.interp: ", ifile)
+print("Read junk after closing: ", cfile)
+print("MSB file did not match LSB file: ", efile)
+print("Shimadzu file did not read: ", sfile)